@@ -0,0 +1,217 @@
+import mmap
+import struct
+
+import columns_game as Game
+import columns_replay as Replay
+
+
+_magic = b'CLRA'
+_version = 3
+
+_header = struct.Struct('<4sBHHQI')
+_segment = struct.Struct('<QII')
+_entry = struct.Struct('<QQ')
+_trailer = struct.Struct('<QIQ4s')
+
+
+class ArchiveWriter(Replay.Recorder):
+    '''
+    Recorder that streams a long game to a seekable archive file
+
+    The archive is a run of segments, each a GameState snapshot taken every
+    interval clock ticks followed by the inputs up to the next one, in the
+    replay encoding. An index of segment ticks and offsets is written last,
+    so readers can find the keyframe before any tick without a scan.
+    Keyframe gem codes are only shared between processes for gems in gem_list.
+    '''
+    def __init__(self, path: str, state: Game.GameState, seed: int = 0, interval: int = 600):
+        Replay.Recorder.__init__(self, state, seed)
+
+        if interval < 1:
+            raise ValueError('keyframe interval must be at least one tick')
+
+        self._interval = interval
+        self._index = []
+
+        self._file = open(path, 'wb')
+        self._file.write(_header.pack(_magic, _version, state.number_of_rows(), state.number_of_columns(), seed, interval))
+
+        self._start_segment()
+
+
+
+    def __enter__(self) -> 'ArchiveWriter':
+        return self
+
+
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+
+
+    def clock(self) -> bool:
+        '''
+        Records a clock tick and starts a new segment every interval ticks
+        '''
+        value = Replay.Recorder.clock(self)
+
+        if self._ticks % self._interval == 0:
+            self._write_segment()
+            self._start_segment()
+
+        return value
+
+
+
+    def close(self) -> None:
+        '''
+        Writes the last segment and the index and closes the file
+        '''
+        if self._file.closed:
+            return
+
+        self._write_segment()
+
+        index_offset = self._file.tell()
+
+        for tick, offset in self._index:
+            self._file.write(_entry.pack(tick, offset))
+
+        self._file.write(_trailer.pack(index_offset, len(self._index), self._ticks, _magic))
+        self._file.close()
+
+
+
+    def _start_segment(self) -> None:
+        '''
+        Takes a keyframe and starts collecting the inputs that follow it
+        '''
+        self._segment_tick = self._ticks
+        self._keyframe = self._state.snapshot()
+
+        self._data = bytearray()
+        self._last = None
+        self._gem_codes = {}
+
+
+
+    def _write_segment(self) -> None:
+        '''
+        Appends the current keyframe and its inputs to the file
+        '''
+        self._index.append((self._segment_tick, self._file.tell()))
+
+        self._file.write(_segment.pack(self._segment_tick, len(self._keyframe), len(self._data)))
+        self._file.write(self._keyframe)
+        self._file.write(self._data)
+
+
+
+class ArchiveReader:
+    '''
+    Memory-mapped view of an archive that restores the game at any tick
+    '''
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self._rows, self._columns, self._seed, self._interval = _header.unpack_from(self._map)
+
+        if magic != _magic:
+            raise ValueError('not a Columns replay archive')
+
+        if version != _version:
+            raise ValueError('unsupported archive version {}'.format(version))
+
+        self._index_offset, self._segments, self._ticks, magic = _trailer.unpack_from(self._map, len(self._map) - _trailer.size)
+
+        if magic != _magic:
+            raise ValueError('replay archive was not closed')
+
+
+
+    def __enter__(self) -> 'ArchiveReader':
+        return self
+
+
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+
+
+    def ticks(self) -> int:
+        '''
+        Returns the number of clock ticks in the archive
+        '''
+        return self._ticks
+
+
+
+    def seed(self) -> int:
+        '''
+        Returns the seed stored with the archive
+        '''
+        return self._seed
+
+
+
+    def seek(self, tick: int, state: Game.GameState = None) -> Game.GameState:
+        '''
+        Returns the game as it was right after the specified clock tick
+        Restores the nearest keyframe at or before it and plays at most one interval of inputs
+        '''
+        if tick < 0 or tick > self._ticks:
+            raise ValueError('tick {} is outside the archive'.format(tick))
+
+        if state is None:
+            state = Game.GameState(self._rows, self._columns)
+
+        segment_tick, offset = self._entry(self._find_segment(tick))
+        segment_tick, keyframe_size, inputs_size = _segment.unpack_from(self._map, offset)
+
+        start = offset + _segment.size
+        state.restore(self._map[start:start + keyframe_size])
+
+        start += keyframe_size
+        Replay.play_inputs(state, self._map[start:start + inputs_size], 0, [], tick - segment_tick)
+
+        return state
+
+
+
+    def close(self) -> None:
+        '''
+        Releases the mapping and the file
+        '''
+        self._map.close()
+        self._file.close()
+
+
+
+    def _entry(self, segment: int) -> (int, int):
+        '''
+        Returns the keyframe tick and file offset of a segment
+        '''
+        return _entry.unpack_from(self._map, self._index_offset + segment * _entry.size)
+
+
+
+    def _find_segment(self, tick: int) -> int:
+        '''
+        Returns the last segment whose keyframe is at or before the specified tick
+        '''
+        low = 0
+        high = self._segments - 1
+
+        while low < high:
+            middle = (low + high + 1) // 2
+
+            if self._entry(middle)[0] <= tick:
+                low = middle
+
+            else:
+                high = middle - 1
+
+        return low
@@ -0,0 +1,473 @@
+import re
+
+from columns_game import empty_cell, faller_moving_cell, faller_stopped_cell, occupied_cell, matching_cell
+from columns_game import left, right, down, empty
+from columns_game import Faller, faller_stopped, faller_moving
+
+from columns_game import gem_list, PieceSource
+from columns_game import cells_changed, faller_moved, faller_landed, cells_matched, cells_cleared, cells_fell
+
+
+# Includes the columns_game names a frontend uses, so it can switch backends by changing its import
+__all__ = [
+    'GameState', 'Faller', 'PieceSource', 'gem_list',
+    'empty_cell', 'faller_moving_cell', 'faller_stopped_cell', 'occupied_cell', 'matching_cell',
+    'left', 'right', 'down', 'empty', 'faller_stopped', 'faller_moving',
+    'cells_changed', 'faller_moved', 'faller_landed', 'cells_matched', 'cells_cleared', 'cells_fell'
+]
+
+
+_state_names = [empty_cell, faller_moving_cell, faller_stopped_cell, occupied_cell, matching_cell]
+_state_codes = {name: code for code, name in enumerate(_state_names)}
+
+_state_shift = 5
+_gem_mask = (1 << _state_shift) - 1
+
+_occupied_code = _state_codes[occupied_cell]
+_matching_code = _state_codes[matching_cell]
+
+
+def _build_table(function) -> bytes:
+    '''
+    Builds a translation table from cell codes
+    '''
+    return bytes(function(code >> _state_shift, code & _gem_mask) for code in range(256))
+
+
+_match_key_table = _build_table(lambda state, gem: gem if state == _occupied_code or state == _matching_code else 0)
+_occupied_table = _build_table(lambda state, gem: 1 if state == _occupied_code else 0)
+_clear_table = _build_table(lambda state, gem: 0 if state == _matching_code else (state << _state_shift) | gem)
+
+_run_pattern = re.compile(rb'([\x01-\x1f])\1\1+')
+
+
+def _line_runs(key: bytes, start: int, step: int) -> [int]:
+    '''
+    Returns the cell indexes of every run of three or more equal gems
+    along the line that begins at start and advances by step
+    '''
+    cells = []
+
+    for run in _run_pattern.finditer(key[start::step]):
+        for i in range(run.start(), run.end()):
+            cells.append(start + i * step)
+
+    return cells
+
+
+class GameState:
+    '''
+    Columns game board stored as one byte per cell
+
+    Each byte holds the gem code in its low five bits and the cell state in
+    the high three. Rows are padded with an unused column of zero bytes, so
+    rows, columns and diagonals can all be read as strided slices.
+    '''
+    def __init__(self, rows: int, columns: int):
+        self._rows = rows
+        self._columns = columns
+        self._stride = columns + 1
+
+        self._board = bytearray(rows * self._stride)
+
+        self._gem_codes = {empty: 0}
+        self._gem_names = [empty]
+
+        self._faller = Faller()
+
+
+
+    def board_contents(self, contents: [[str]]) -> None:
+        '''
+        Assigns contents to game board
+        Gravity is applied and matching is attempted
+        '''
+        for row in range(self.number_of_rows()):
+            for column in range(self.number_of_columns()):
+                value = contents[row][column]
+
+                if value == empty:
+                    self._cell(row, column, empty, empty_cell)
+
+                else:
+                    self._cell(row, column, value, occupied_cell)
+
+        self._gravity()
+        self._matching()
+
+
+
+    def clock(self) -> bool:
+        '''
+        Moves fallers down
+        '''
+        if self._faller.active:
+            if self._faller.state == faller_stopped:
+                self._update_faller_state()
+
+                if self._faller.state == faller_stopped:
+                    value = False
+
+                    if self._faller.row_value() - 2 < 0:
+                        value = True
+
+                    for i in range(3):
+                        self._cell(self._faller.row_value() - i, self._faller.column_value(), self._faller.contents[i], occupied_cell)
+                    self._faller.active = False
+
+                    self._matching()
+
+                    return value
+
+            self._move_faller_down()
+
+            self._update_faller_state()
+
+        self._matching()
+
+        return False
+
+
+
+    def generate_faller(self, column: int, faller: [str, str, str]) -> None:
+        '''
+        Generates a faller in the specied column
+        '''
+        if self._faller.active:
+            return
+
+        self._faller.active = True
+
+        self._faller.contents = faller
+
+        self._faller.assign_row(0)
+        self._faller.assign_column(column - 1)
+
+        self._cell(0, self._faller.column_value(), self._faller.contents[0], faller_moving_cell)
+
+        self._update_faller_state()
+
+
+
+    def active_faller(self) -> bool:
+        '''
+        Determines if there is an active faller
+        '''
+        return self._faller.active
+
+
+
+    def rotate(self) -> None:
+        '''
+        Rotates faller
+        '''
+        if not self._faller.active:
+            return
+
+        first_faller = self._faller.contents[0]
+        second_faller = self._faller.contents[1]
+        third_faller = self._faller.contents[2]
+
+        self._faller.contents = [second_faller, third_faller, first_faller]
+
+        for i in range(3):
+            self._cell_contents(self._faller.row_value() - i, self._faller.column_value(), self._faller.contents[i])
+
+        self._update_faller_state()
+
+
+
+    def move_side(self, direction: int) -> None:
+        '''
+        Moves faller in specified direction when not blocked
+        '''
+        if not self._faller.active:
+            return
+
+        if not direction == right and not direction == left:
+            return
+
+        if (direction == left and self._faller.column_value() == 0) or (direction == right and self._faller.column_value() == self.number_of_columns() - 1):
+            return
+
+        target_move_column = self._faller.column_value() + direction
+
+        for i in range(3):
+            if self._faller.row_value() - i < 0:
+                break
+
+            if self.current_cell_state(self._faller.row_value() - i, target_move_column) == occupied_cell:
+                return
+
+        for i in range(3):
+            if self._faller.row_value() - i < 0:
+                break
+
+            self._move_cell(self._faller.row_value() - i, self._faller.column_value(), direction)
+
+        self._faller.assign_column(target_move_column)
+
+        self._update_faller_state()
+
+
+
+    def number_of_rows(self) -> int:
+        '''
+        Returns number of rows in current game board
+        '''
+        return self._rows
+
+
+
+    def number_of_columns(self) -> int:
+        '''
+        Returns number of columns in current game board
+        '''
+        return self._columns
+
+
+
+    def current_cell_state(self, row: int, column: int) -> str:
+        '''
+        Returns state of cell for the specified row and column
+        '''
+        return _state_names[self._board[row * self._stride + column] >> _state_shift]
+
+
+
+    def current_cell_contents(self, row: int, column: int) -> str:
+        '''
+        Returns contents of cell for the specifid row and column
+        '''
+        return self._gem_names[self._board[row * self._stride + column] & _gem_mask]
+
+
+
+    def _gem_code(self, contents: str) -> int:
+        '''
+        Returns the code of the specified gem, assigning one if needed
+        '''
+        code = self._gem_codes.get(contents)
+
+        if code is None:
+            code = len(self._gem_names)
+
+            if code > _gem_mask:
+                raise ValueError('too many different gems for an array board')
+
+            self._gem_codes[contents] = code
+            self._gem_names.append(contents)
+
+        return code
+
+
+
+    def _cell(self, row: int, column: int, contents: str, state: str) -> None:
+        '''
+        Sets characteristics of cell for specified row and column
+        '''
+        if row < 0:
+            return
+
+        self._board[row * self._stride + column] = (_state_codes[state] << _state_shift) | self._gem_code(contents)
+
+
+
+    def _cell_contents(self, row: int, column: int, contents: str) -> None:
+        '''
+        Sets contents of cell for specified row and column
+        '''
+        if row < 0:
+            return
+
+        index = row * self._stride + column
+        self._board[index] = (self._board[index] & ~_gem_mask) | self._gem_code(contents)
+
+
+
+    def _cell_state(self, row: int, column: int, state: str) -> None:
+        '''
+        Sets state of cell for specified row and column
+        '''
+        if row < 0:
+            return
+
+        index = row * self._stride + column
+        self._board[index] = (_state_codes[state] << _state_shift) | (self._board[index] & _gem_mask)
+
+
+
+    def _gravity(self) -> None:
+        '''
+        Gravity is applied to all cells until it reaches a solid cell
+        '''
+        end = self.number_of_rows() * self._stride
+        occupied = self._board.translate(_occupied_table)
+
+        for column in range(self.number_of_columns()):
+            if b'\x01\x00' in occupied[column:end:self._stride]:
+                self._compact_column(column)
+
+
+
+    def _compact_column(self, column: int) -> None:
+        '''
+        Drops the occupied cells of a column onto the bottom of the board
+        Any other cell an occupied cell falls through is emptied
+        '''
+        end = self.number_of_rows() * self._stride
+        cells = self._board[column:end:self._stride]
+
+        stack = bytearray()
+        highest = len(cells)
+
+        for row in range(len(cells)):
+            if cells[row] >> _state_shift == _occupied_code:
+                stack.append(cells[row])
+
+                if highest == len(cells):
+                    highest = row
+
+        gap = len(cells) - highest - len(stack)
+
+        self._board[column:end:self._stride] = cells[:highest] + bytes(gap) + stack
+
+
+
+    def _matching(self) -> None:
+        '''
+        Removes cells that are matching and applies gravity to remaining cells
+        '''
+        self._board[:] = self._board.translate(_clear_table)
+
+        self._gravity()
+
+        key = self._board.translate(_match_key_table)
+
+        self._match_horizontal(key)
+        self._match_vertical(key)
+        self._match_diagonal(key)
+        self._match_anti_diagonal(key)
+
+
+
+    def _match_horizontal(self, key: bytes) -> None:
+        '''
+        Checks if cells are matching horizontally
+        '''
+        self._mark_matched_cells(_line_runs(key, 0, 1))
+
+
+
+    def _match_vertical(self, key: bytes) -> None:
+        '''
+        Checks if cells are matching vertically
+        '''
+        for column in range(self.number_of_columns()):
+            self._mark_matched_cells(_line_runs(key, column, self._stride))
+
+
+
+    def _match_diagonal(self, key: bytes) -> None:
+        '''
+        Checks if cells are matching from bottom left to top right
+        '''
+        for start in range(self._stride - 1):
+            self._mark_matched_cells(_line_runs(key, start, self._stride - 1))
+
+
+
+    def _match_anti_diagonal(self, key: bytes) -> None:
+        '''
+        Checks if cells are matching from bottom right to top left
+        '''
+        for start in range(self._stride + 1):
+            self._mark_matched_cells(_line_runs(key, start, self._stride + 1))
+
+
+
+    def _mark_matched_cells(self, cells: [int]) -> None:
+        '''
+        Determines that the specified cells are matching
+        '''
+        for index in cells:
+            self._board[index] = (_matching_code << _state_shift) | (self._board[index] & _gem_mask)
+
+
+
+    def _update_faller_state(self) -> None:
+        '''
+        Updates states of fallers on the current game board
+        '''
+        state = None
+        target_row = self._faller.row_value() + 1
+
+        if self._solid_faller(target_row, self._faller.column_value()):
+            state = faller_stopped_cell
+            self._faller.state = faller_stopped
+
+        else:
+            state = faller_moving_cell
+            self._faller.state = faller_moving
+
+        for i in range(3):
+            row = self._faller.row_value() - i
+
+            if row < 0:
+                return
+
+            self._cell(row, self._faller.column_value(), self._faller.contents[i], state)
+
+
+
+    def _solid_faller(self, row: int, column: int) -> bool:
+        '''
+        Determines if faller is a solid or not
+        '''
+        if row >= self.number_of_rows():
+            return True
+
+        return self._board[row * self._stride + column] >> _state_shift == _occupied_code
+
+
+
+    def _move_faller_down(self) -> None:
+        '''
+        Moves faller down
+        '''
+        if self._solid_faller(self._faller.row_value() + 1, self._faller.column_value()):
+            return
+
+        self._move_cell(self._faller.row_value(), self._faller.column_value(), down)
+
+        if self._faller.row_value() - 1 >= 0:
+            self._move_cell(self._faller.row_value() - 1, self._faller.column_value(), down)
+
+            if self._faller.row_value() - 2 >= 0:
+                self._move_cell(self._faller.row_value() - 2, self._faller.column_value(), down)
+
+            else:
+                self._cell(self._faller.row_value() - 1, self._faller.column_value(), self._faller.contents[2],
+                               faller_moving_cell)
+
+        else:
+            self._cell(self._faller.row_value(), self._faller.column_value(), self._faller.contents[1], faller_moving_cell)
+
+        self._faller.assign_row(self._faller.row_value() + 1)
+
+
+
+    def _move_cell(self, row: int, column: int, direction: int) -> None:
+        '''
+        Moves cell in specified direction
+        '''
+        index = row * self._stride + column
+
+        if direction == down:
+            target = index + self._stride
+
+        else:
+            target = index + direction
+
+        self._board[target] = self._board[index]
+        self._board[index] = 0
@@ -0,0 +1,456 @@
+from columns_game import empty_cell, faller_moving_cell, faller_stopped_cell
+from columns_game import left, right, empty
+from columns_array import _state_names, _state_codes, _state_shift, _gem_mask, _occupied_code, _matching_code
+from columns_array import _match_key_table, _clear_table, _line_runs
+
+
+_guard = 0xff
+
+_occupied_table = bytes(2 if code == _guard else 1 if code >> _state_shift == _occupied_code else 0 for code in range(256))
+
+_empty_code = _state_codes[empty_cell]
+_moving_code = _state_codes[faller_moving_cell]
+_stopped_code = _state_codes[faller_stopped_cell]
+
+
+class BatchGameState:
+    '''
+    Several independent Columns boards stepped together
+
+    Boards share one bytearray in the columns_array cell encoding. Each board
+    is followed by a guard row and every row by a guard column, so the boards
+    that changed on a tick are scanned for matches with a few slices.
+    '''
+    def __init__(self, boards: int, rows: int, columns: int, auto_reset: bool = False):
+        self._boards = boards
+        self._rows = rows
+        self._columns = columns
+        self._auto_reset = auto_reset
+
+        self._stride = columns + 1
+        self._board_size = (rows + 1) * self._stride
+
+        self._cells = bytearray(boards * self._board_size)
+
+        self._gem_codes = {empty: 0}
+        self._gem_names = [empty]
+
+        self._active = [False] * boards
+        self._stopped = [False] * boards
+        self._faller_rows = [0] * boards
+        self._faller_columns = [0] * boards
+        self._faller_contents = [[0, 0, 0] for board in range(boards)]
+
+        self._done = [False] * boards
+
+        self._changed = set()
+        self._marked = set()
+
+        for board in range(boards):
+            self._clear_board(board)
+
+
+
+    def number_of_boards(self) -> int:
+        '''
+        Returns number of boards in the batch
+        '''
+        return self._boards
+
+
+
+    def number_of_rows(self) -> int:
+        '''
+        Returns number of rows in each board
+        '''
+        return self._rows
+
+
+
+    def number_of_columns(self) -> int:
+        '''
+        Returns number of columns in each board
+        '''
+        return self._columns
+
+
+
+    def board_contents(self, board: int, contents: [[str]]) -> None:
+        '''
+        Assigns contents to the specified board
+        Gravity is applied and matching is attempted
+        '''
+        for row in range(self._rows):
+            for column in range(self._columns):
+                value = contents[row][column]
+
+                if value == empty:
+                    self._cell(board, row, column, 0, _empty_code)
+
+                else:
+                    self._cell(board, row, column, self._gem_code(value), _occupied_code)
+
+        self._gravity(board)
+
+        self._changed.add(board)
+        self._matching([board])
+
+
+
+    def clock(self, mask: [bool] = None) -> [bool]:
+        '''
+        Moves the fallers of every selected board down
+        Returns which boards ended their game on this tick
+        '''
+        boards = self._selected(mask)
+        ended = [False] * self._boards
+
+        for board in boards:
+            ended[board] = self._clock_faller(board)
+
+        self._matching(boards)
+
+        for board in boards:
+            if ended[board]:
+                self._done[board] = True
+
+                if self._auto_reset:
+                    self.reset_board(board)
+
+        return ended
+
+
+
+    def generate_faller(self, columns: [int], fallers: [[str, str, str]], mask: [bool] = None) -> None:
+        '''
+        Generates a faller in the specified column of every selected board without one
+        '''
+        for board in self._selected(mask):
+            if self._active[board]:
+                continue
+
+            self._active[board] = True
+            self._faller_contents[board] = [self._gem_code(gem) for gem in fallers[board]]
+            self._faller_rows[board] = 0
+            self._faller_columns[board] = columns[board] - 1
+
+            if self._state(board, 0, self._faller_columns[board]) >= _occupied_code:
+                self._changed.add(board)
+
+            self._cell(board, 0, self._faller_columns[board], self._faller_contents[board][0], _moving_code)
+
+            self._update_faller_state(board)
+
+
+
+    def rotate(self, mask: [bool] = None) -> None:
+        '''
+        Rotates the faller of every selected board
+        '''
+        for board in self._selected(mask):
+            if not self._active[board]:
+                continue
+
+            contents = self._faller_contents[board]
+            contents[:] = [contents[1], contents[2], contents[0]]
+
+            self._update_faller_state(board)
+
+
+
+    def move_side(self, directions: [int]) -> None:
+        '''
+        Moves the faller of every board in its own direction when not blocked
+        A direction other than left or right leaves that board alone
+        '''
+        for board in self._selected(None):
+            direction = directions[board]
+
+            if not self._active[board] or (direction != left and direction != right):
+                continue
+
+            column = self._faller_columns[board]
+            target_column = column + direction
+
+            if target_column < 0 or target_column >= self._columns:
+                continue
+
+            index = self._index(board, self._faller_rows[board], column)
+            indexes = range(index, index - min(3, self._faller_rows[board] + 1) * self._stride, -self._stride)
+
+            if any(self._cells[i + direction] >> _state_shift == _occupied_code for i in indexes):
+                continue
+
+            for i in indexes:
+                self._cells[i + direction] = self._cells[i]
+                self._cells[i] = 0
+
+            self._faller_columns[board] = target_column
+
+            self._update_faller_state(board)
+
+
+
+    def active_fallers(self) -> [bool]:
+        '''
+        Determines which boards have an active faller
+        '''
+        return list(self._active)
+
+
+
+    def done(self) -> [bool]:
+        '''
+        Determines which boards have ended and are waiting to be reset
+        '''
+        return list(self._done)
+
+
+
+    def reset_board(self, board: int) -> None:
+        '''
+        Empties the specified board and starts a new game on it
+        '''
+        self._clear_board(board)
+
+        self._active[board] = False
+        self._stopped[board] = False
+        self._done[board] = False
+
+        self._changed.discard(board)
+        self._marked.discard(board)
+
+
+
+    def current_cell_state(self, board: int, row: int, column: int) -> str:
+        '''
+        Returns state of cell for the specified board, row and column
+        '''
+        return _state_names[self._state(board, row, column)]
+
+
+
+    def current_cell_contents(self, board: int, row: int, column: int) -> str:
+        '''
+        Returns contents of cell for the specified board, row and column
+        '''
+        return self._gem_names[self._cells[self._index(board, row, column)] & _gem_mask]
+
+
+
+    def _selected(self, mask: [bool]) -> [int]:
+        '''
+        Returns the boards chosen by the mask that have not ended
+        '''
+        return [board for board in range(self._boards) if not self._done[board] and (mask is None or mask[board])]
+
+
+
+    def _index(self, board: int, row: int, column: int) -> int:
+        '''
+        Returns the position of a cell in the stacked cells
+        '''
+        return board * self._board_size + row * self._stride + column
+
+
+
+    def _state(self, board: int, row: int, column: int) -> int:
+        '''
+        Returns the state code of the specified cell
+        '''
+        return self._cells[self._index(board, row, column)] >> _state_shift
+
+
+
+    def _gem_code(self, contents: str) -> int:
+        '''
+        Returns the code of the specified gem, assigning one if needed
+        '''
+        code = self._gem_codes.get(contents)
+
+        if code is None:
+            code = len(self._gem_names)
+
+            if code > _gem_mask:
+                raise ValueError('too many different gems for a batch board')
+
+            self._gem_codes[contents] = code
+            self._gem_names.append(contents)
+
+        return code
+
+
+
+    def _cell(self, board: int, row: int, column: int, gem: int, state: int) -> None:
+        '''
+        Sets characteristics of cell for specified board, row and column
+        '''
+        if row < 0:
+            return
+
+        self._cells[self._index(board, row, column)] = (state << _state_shift) | gem
+
+
+
+    def _clear_board(self, board: int) -> None:
+        '''
+        Empties a board and restores its guard cells
+        '''
+        start = board * self._board_size
+        end = start + self._board_size
+
+        self._cells[start:end] = bytes(self._board_size)
+        self._cells[start + self._columns:end:self._stride] = bytes([_guard]) * (self._rows + 1)
+        self._cells[end - self._stride:end] = bytes([_guard]) * self._stride
+
+
+
+    def _clock_faller(self, board: int) -> bool:
+        '''
+        Moves the faller of one board down, landing it when it cannot move
+        Returns whether the landing ended the game
+        '''
+        if not self._active[board]:
+            return False
+
+        row = self._faller_rows[board]
+        column = self._faller_columns[board]
+
+        if self._stopped[board]:
+            self._update_faller_state(board)
+
+            if self._stopped[board]:
+                for i in range(3):
+                    self._cell(board, row - i, column, self._faller_contents[board][i], _occupied_code)
+
+                self._active[board] = False
+                self._changed.add(board)
+
+                return row - 2 < 0
+
+        if not self._solid(board, row + 1, column):
+            index = self._index(board, row, column)
+
+            for i in range(min(3, row + 1)):
+                self._cells[index - (i - 1) * self._stride] = self._cells[index - i * self._stride]
+
+            if row >= 2:
+                self._cells[index - 2 * self._stride] = 0
+
+            self._faller_rows[board] = row + 1
+
+        self._update_faller_state(board)
+
+        return False
+
+
+
+    def _update_faller_state(self, board: int) -> None:
+        '''
+        Updates the states of the faller cells of one board
+        '''
+        row = self._faller_rows[board]
+        index = self._index(board, row, self._faller_columns[board])
+
+        self._stopped[board] = self._solid(board, row + 1, self._faller_columns[board])
+
+        state = (_stopped_code if self._stopped[board] else _moving_code) << _state_shift
+        contents = self._faller_contents[board]
+
+        for i in range(min(3, row + 1)):
+            self._cells[index - i * self._stride] = state | contents[i]
+
+
+
+    def _solid(self, board: int, row: int, column: int) -> bool:
+        '''
+        Determines if a cell stops a faller
+        '''
+        return row >= self._rows or self._state(board, row, column) == _occupied_code
+
+
+
+    def _matching(self, boards: [int]) -> None:
+        '''
+        Removes matching cells of the specified boards and applies gravity to them
+        Boards that changed are then scanned together for runs of three or more
+        '''
+        cleared = [board for board in boards if board in self._marked]
+
+        for board in cleared:
+            start = board * self._board_size
+            end = start + self._board_size
+
+            self._cells[start:end] = self._cells[start:end].translate(_clear_table)
+            self._gravity(board)
+
+        self._marked.difference_update(cleared)
+
+        changed = sorted((self._changed & set(boards)) | set(cleared))
+        self._changed.difference_update(changed)
+
+        if not changed:
+            return
+
+        key = b''.join(self._cells[board * self._board_size:(board + 1) * self._board_size] for board in changed)
+        key = key.translate(_match_key_table)
+
+        for start, step in self._lines():
+            for index in _line_runs(key, start, step):
+                board = changed[index // self._board_size]
+                index = board * self._board_size + index % self._board_size
+
+                self._cells[index] = (_matching_code << _state_shift) | (self._cells[index] & _gem_mask)
+                self._marked.add(board)
+
+
+
+    def _lines(self) -> [(int, int)]:
+        '''
+        Returns the start and step of every strided slice that covers the
+        rows, columns and both diagonals of stacked boards
+        '''
+        lines = [(0, 1)]
+
+        for step in (self._stride, self._stride - 1, self._stride + 1):
+            lines.extend((start, step) for start in range(step))
+
+        return lines
+
+
+
+    def _gravity(self, board: int) -> None:
+        '''
+        Compacts every column of the specified board that has a floating cell
+        '''
+        start = board * self._board_size
+        occupied = self._cells[start:start + self._board_size].translate(_occupied_table)
+
+        for column in range(self._columns):
+            if b'\x01\x00' in occupied[column::self._stride]:
+                self._compact_column(board, column)
+
+
+
+    def _compact_column(self, board: int, column: int) -> None:
+        '''
+        Drops the occupied cells of a column onto the bottom of its board
+        Any other cell an occupied cell falls through is emptied
+        '''
+        start = self._index(board, 0, column)
+        end = self._index(board, self._rows, column)
+        cells = self._cells[start:end:self._stride]
+
+        stack = bytearray()
+        highest = len(cells)
+
+        for row in range(len(cells)):
+            if cells[row] >> _state_shift == _occupied_code:
+                stack.append(cells[row])
+
+                if highest == len(cells):
+                    highest = row
+
+        gap = len(cells) - highest - len(stack)
+
+        self._cells[start:end:self._stride] = cells[:highest] + bytes(gap) + stack
@@ -0,0 +1,254 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+
+import columns_game as Game
+
+
+sizes = [(13, 6), (40, 20), (200, 100)]
+boards = ['empty', 'nearly_full', 'checkerboard', 'cascade']
+operations = ['board_contents', 'clock', '_matching', '_gravity', 'move_side', 'rotate']
+
+
+def corpus_board(name: str, rows: int, columns: int) -> [[str]]:
+    '''
+    Returns one of the fixed benchmark boards at the specified size
+    '''
+    gems = Game.gem_list
+    board = [[Game.empty] * columns for row in range(rows)]
+
+    for row in range(rows):
+        for column in range(columns):
+            if name == 'nearly_full' and row >= 3:
+                board[row][column] = gems[(row + 3 * column) % len(gems)]
+
+            elif name == 'checkerboard':
+                board[row][column] = gems[(row + column) % 2]
+
+            elif name == 'cascade':
+                board[row][column] = gems[0] if row % 3 == 2 else gems[1 + (row + 3 * column) % (len(gems) - 1)]
+
+    return board
+
+
+
+def _raw_state(board: [[str]]) -> Game.GameState:
+    '''
+    Returns a game with the board written in as it is, every cell still waiting to be matched
+    '''
+    state = Game.GameState(len(board), len(board[0]))
+
+    for row in range(len(board)):
+        for column in range(len(board[0])):
+            if board[row][column] != Game.empty:
+                state._cell(row, column, Game.gem_code(board[row][column]), Game.occupied_state)
+
+    return state
+
+
+
+def _holed_state(board: [[str]]) -> Game.GameState:
+    '''
+    Returns a game with every third row of the board emptied and no gravity applied
+    '''
+    state = _raw_state(board)
+
+    for row in range(0, len(board), 3):
+        for column in range(len(board[0])):
+            state._cell(row, column, Game.empty_gem, Game.empty_state)
+
+    return state
+
+
+
+def _playing_state(board: [[str]]) -> Game.GameState:
+    '''
+    Returns a settled game with a faller in the middle column
+    '''
+    state = Game.GameState(len(board), len(board[0]))
+    state.board_contents(board)
+    state.settle()
+    state.generate_faller(len(board[0]) // 2 + 1, Game.gem_list[2:5])
+
+    return state
+
+
+
+def _sampler(operation: str, board: [[str]]):
+    '''
+    Returns a function that times one call of the operation on a fresh copy of its starting game
+    '''
+    if operation == 'board_contents':
+        def sample() -> int:
+            state = Game.GameState(len(board), len(board[0]))
+
+            start = time.perf_counter_ns()
+            state.board_contents(board)
+
+            return time.perf_counter_ns() - start
+
+        return sample
+
+    if operation == '_matching':
+        state = _raw_state(board)
+
+    elif operation == '_gravity':
+        state = _holed_state(board)
+
+    else:
+        state = _playing_state(board)
+
+    snap = state.snapshot()
+    columns = range(state.number_of_columns())
+
+    calls = {
+        'clock': state.clock,
+        '_matching': state._matching,
+        '_gravity': lambda: state._gravity(columns),
+        'move_side': lambda: state.move_side(Game.left),
+        'rotate': state.rotate
+    }
+
+    call = calls[operation]
+
+    def sample() -> int:
+        state.restore(snap)
+
+        start = time.perf_counter_ns()
+        call()
+
+        return time.perf_counter_ns() - start
+
+    return sample
+
+
+
+def _calibrate(samples: int) -> float:
+    '''
+    Returns the fastest time in microseconds of a fixed pure Python workload
+    It is taken before and after a run, and comparisons scale by it so a
+    slower or busier machine is not reported as a regression
+    '''
+    times = []
+
+    for i in range(samples):
+        start = time.perf_counter_ns()
+
+        total = 0
+
+        for value in range(20000):
+            total += value & 7
+
+        times.append((time.perf_counter_ns() - start) / 1000)
+
+    return min(times)
+
+
+
+def run_benchmarks(sizes: [(int, int)] = sizes, samples: int = 25) -> dict:
+    '''
+    Times every operation on every corpus board at every size
+    Returns the median and fastest time of each in microseconds
+    '''
+    results = {}
+    calibration = _calibrate(samples)
+
+    for rows, columns in sizes:
+        for name in boards:
+            board = corpus_board(name, rows, columns)
+
+            for operation in operations:
+                sample = _sampler(operation, board)
+                sample()
+
+                times = [sample() / 1000 for i in range(samples)]
+
+                results['{}x{}/{}/{}'.format(rows, columns, name, operation)] = {
+                    'median_us': statistics.median(times),
+                    'min_us': min(times)
+                }
+
+    return {
+        'python': platform.python_version(),
+        'samples': samples,
+        'calibration_us': (calibration + _calibrate(samples)) / 2,
+        'results': results
+    }
+
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.1) -> [str]:
+    '''
+    Returns a line for every benchmark whose fastest time is slower than the baseline by more than threshold
+    The fastest of the samples is compared because it is the least disturbed by other load
+    '''
+    regressions = []
+    scale = current['calibration_us'] / baseline['calibration_us']
+
+    for key, result in current['results'].items():
+        reference = baseline['results'].get(key)
+
+        if reference is None:
+            continue
+
+        ratio = result['min_us'] / (reference['min_us'] * scale) if reference['min_us'] else 1.0
+
+        if ratio > 1.0 + threshold:
+            regressions.append('{}: {:.1f}us -> {:.1f}us ({:+.0%})'.format(
+                key, reference['min_us'], result['min_us'], ratio - 1.0))
+
+    return regressions
+
+
+
+def _parse_size(text: str) -> (int, int):
+    '''
+    Converts a ROWSxCOLUMNS argument to a size
+    '''
+    rows, columns = text.lower().split('x')
+
+    return int(rows), int(columns)
+
+
+
+def _main() -> None:
+    '''
+    Runs the benchmarks from the command line, writing JSON and checking against a baseline
+    '''
+    parser = argparse.ArgumentParser(description='Benchmarks the Columns game engine without a display')
+    parser.add_argument('--sizes', nargs='+', type=_parse_size, default=sizes)
+    parser.add_argument('--samples', type=int, default=25)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments.sizes, arguments.samples)
+
+    if arguments.output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    else:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+
+    if arguments.compare is not None:
+        with open(arguments.compare) as file:
+            baseline = json.load(file)
+
+        regressions = compare(results, baseline, arguments.threshold)
+
+        for line in regressions:
+            print('regression {}'.format(line), file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,517 @@
+from columns_game import empty_cell, faller_moving_cell, faller_stopped_cell, occupied_cell, matching_cell
+from columns_game import left, right, down, empty
+from columns_game import Faller, faller_stopped, faller_moving
+
+from columns_game import gem_list, PieceSource
+from columns_game import cells_changed, faller_moved, faller_landed, cells_matched, cells_cleared, cells_fell
+
+
+# Includes the columns_game names a frontend uses, so it can switch backends by changing its import
+__all__ = [
+    'GameState', 'Faller', 'PieceSource', 'gem_list',
+    'empty_cell', 'faller_moving_cell', 'faller_stopped_cell', 'occupied_cell', 'matching_cell',
+    'left', 'right', 'down', 'empty', 'faller_stopped', 'faller_moving',
+    'cells_changed', 'faller_moved', 'faller_landed', 'cells_matched', 'cells_cleared', 'cells_fell'
+]
+
+
+class GameState:
+    '''
+    Columns game board stored as integer bitboards
+
+    Every cell owns one bit at row * (columns + 1) + column. The extra
+    column on each row is never set, so shifted masks cannot wrap from
+    one row into the next.
+    '''
+    def __init__(self, rows: int, columns: int):
+        self._rows = rows
+        self._columns = columns
+        self._stride = columns + 1
+
+        self._gems = {}
+
+        self._occupied = 0
+        self._matching_cells = 0
+        self._moving = 0
+        self._stopped = 0
+
+        self._faller = Faller()
+
+        self._column_masks = []
+
+        for column in range(columns):
+            mask = 0
+
+            for row in range(rows):
+                mask |= self._bit(row, column)
+
+            self._column_masks.append(mask)
+
+        self._bottom_row = 0
+
+        for column in range(columns):
+            self._bottom_row |= self._bit(rows - 1, column)
+
+
+
+    def board_contents(self, contents: [[str]]) -> None:
+        '''
+        Assigns contents to game board
+        Gravity is applied and matching is attempted
+        '''
+        for row in range(self.number_of_rows()):
+            for column in range(self.number_of_columns()):
+                value = contents[row][column]
+
+                if value == empty:
+                    self._cell(row, column, empty, empty_cell)
+
+                else:
+                    self._cell(row, column, value, occupied_cell)
+
+        self._gravity()
+        self._matching()
+
+
+
+    def clock(self) -> bool:
+        '''
+        Moves fallers down
+        '''
+        if self._faller.active:
+            if self._faller.state == faller_stopped:
+                self._update_faller_state()
+
+                if self._faller.state == faller_stopped:
+                    value = False
+
+                    if self._faller.row_value() - 2 < 0:
+                        value = True
+
+                    for i in range(3):
+                        self._cell(self._faller.row_value() - i, self._faller.column_value(), self._faller.contents[i], occupied_cell)
+                    self._faller.active = False
+
+                    self._matching()
+
+                    return value
+
+            self._move_faller_down()
+
+            self._update_faller_state()
+
+        self._matching()
+
+        return False
+
+
+
+    def generate_faller(self, column: int, faller: [str, str, str]) -> None:
+        '''
+        Generates a faller in the specied column
+        '''
+        if self._faller.active:
+            return
+
+        self._faller.active = True
+
+        self._faller.contents = faller
+
+        self._faller.assign_row(0)
+        self._faller.assign_column(column - 1)
+
+        self._cell(0, self._faller.column_value(), self._faller.contents[0], faller_moving_cell)
+
+        self._update_faller_state()
+
+
+
+    def active_faller(self) -> bool:
+        '''
+        Determines if there is an active faller
+        '''
+        return self._faller.active
+
+
+
+    def rotate(self) -> None:
+        '''
+        Rotates faller
+        '''
+        if not self._faller.active:
+            return
+
+        first_faller = self._faller.contents[0]
+        second_faller = self._faller.contents[1]
+        third_faller = self._faller.contents[2]
+
+        self._faller.contents = [second_faller, third_faller, first_faller]
+
+        for i in range(3):
+            self._cell_contents(self._faller.row_value() - i, self._faller.column_value(), self._faller.contents[i])
+
+        self._update_faller_state()
+
+
+
+    def move_side(self, direction: int) -> None:
+        '''
+        Moves faller in specified direction when not blocked
+        '''
+        if not self._faller.active:
+            return
+
+        if not direction == right and not direction == left:
+            return
+
+        if (direction == left and self._faller.column_value() == 0) or (direction == right and self._faller.column_value() == self.number_of_columns() - 1):
+            return
+
+        target_move_column = self._faller.column_value() + direction
+
+        if self._faller_mask(target_move_column) & self._occupied:
+            return
+
+        for i in range(3):
+            if self._faller.row_value() - i < 0:
+                break
+
+            self._move_cell(self._faller.row_value() - i, self._faller.column_value(), direction)
+
+        self._faller.assign_column(target_move_column)
+
+        self._update_faller_state()
+
+
+
+    def number_of_rows(self) -> int:
+        '''
+        Returns number of rows in current game board
+        '''
+        return self._rows
+
+
+
+    def number_of_columns(self) -> int:
+        '''
+        Returns number of columns in current game board
+        '''
+        return self._columns
+
+
+
+    def current_cell_state(self, row: int, column: int) -> str:
+        '''
+        Returns state of cell for the specified row and column
+        '''
+        return self._state_at(self._bit(row, column))
+
+
+
+    def current_cell_contents(self, row: int, column: int) -> str:
+        '''
+        Returns contents of cell for the specifid row and column
+        '''
+        return self._gem_at(self._bit(row, column))
+
+
+
+    def _bit(self, row: int, column: int) -> int:
+        '''
+        Returns the bit of the specified row and column
+        '''
+        return 1 << (row * self._stride + column)
+
+
+
+    def _faller_mask(self, column: int) -> int:
+        '''
+        Returns the mask of the on-board faller rows in the specified column
+        '''
+        mask = 0
+
+        for i in range(3):
+            row = self._faller.row_value() - i
+
+            if row < 0:
+                break
+
+            mask |= self._bit(row, column)
+
+        return mask
+
+
+
+    def _state_at(self, bit: int) -> str:
+        '''
+        Returns the state stored for the specified bit
+        '''
+        if self._occupied & bit:
+            return occupied_cell
+
+        if self._matching_cells & bit:
+            return matching_cell
+
+        if self._moving & bit:
+            return faller_moving_cell
+
+        if self._stopped & bit:
+            return faller_stopped_cell
+
+        return empty_cell
+
+
+
+    def _gem_at(self, bit: int) -> str:
+        '''
+        Returns the gem stored for the specified bit
+        '''
+        for gem, mask in self._gems.items():
+            if mask & bit:
+                return gem
+
+        return empty
+
+
+
+    def _cell(self, row: int, column: int, contents: str, state: str) -> None:
+        '''
+        Sets characteristics of cell for specified row and column
+        '''
+        if row < 0:
+            return
+
+        bit = self._bit(row, column)
+
+        self._set_gem(bit, contents)
+        self._set_state(bit, state)
+
+
+
+    def _cell_contents(self, row: int, column: int, contents: str) -> None:
+        '''
+        Sets contents of cell for specified row and column
+        '''
+        if row < 0:
+            return
+
+        self._set_gem(self._bit(row, column), contents)
+
+
+
+    def _cell_state(self, row: int, column: int, state: str) -> None:
+        '''
+        Sets state of cell for specified row and column
+        '''
+        if row < 0:
+            return
+
+        self._set_state(self._bit(row, column), state)
+
+
+
+    def _set_gem(self, bit: int, contents: str) -> None:
+        '''
+        Stores contents in the gem bitboards for the specified bit
+        '''
+        for gem, mask in self._gems.items():
+            if mask & bit:
+                self._gems[gem] = mask & ~bit
+
+        if contents != empty:
+            self._gems[contents] = self._gems.get(contents, 0) | bit
+
+
+
+    def _set_state(self, bit: int, state: str) -> None:
+        '''
+        Stores state in the state masks for the specified bit
+        '''
+        clear = ~bit
+
+        self._occupied &= clear
+        self._matching_cells &= clear
+        self._moving &= clear
+        self._stopped &= clear
+
+        if state == occupied_cell:
+            self._occupied |= bit
+
+        elif state == matching_cell:
+            self._matching_cells |= bit
+
+        elif state == faller_moving_cell:
+            self._moving |= bit
+
+        elif state == faller_stopped_cell:
+            self._stopped |= bit
+
+
+
+    def _gravity(self) -> None:
+        '''
+        Gravity is applied to all cells until it reaches a solid cell
+        '''
+        occupied = self._occupied
+        floating = occupied & ~(occupied >> self._stride) & ~self._bottom_row
+
+        if not floating:
+            return
+
+        for column in range(self.number_of_columns()):
+            if floating & self._column_masks[column]:
+                self._compact_column(column)
+
+
+
+    def _compact_column(self, column: int) -> None:
+        '''
+        Drops the occupied cells of a column onto the bottom of the board
+        Any other cell an occupied cell falls through is emptied
+        '''
+        stack = []
+        highest = self.number_of_rows()
+
+        for row in range(self.number_of_rows() - 1, -1, -1):
+            bit = self._bit(row, column)
+
+            if self._occupied & bit:
+                stack.append(self._gem_at(bit))
+                highest = row
+
+        row = self.number_of_rows() - 1
+
+        for gem in stack:
+            self._cell(row, column, gem, occupied_cell)
+            row -= 1
+
+        while row >= highest:
+            self._cell(row, column, empty, empty_cell)
+            row -= 1
+
+
+
+    def _matching(self) -> None:
+        '''
+        Removes cells that are matching and applies gravity to remaining cells
+        '''
+        cleared = self._matching_cells
+
+        if cleared:
+            for gem, mask in self._gems.items():
+                self._gems[gem] = mask & ~cleared
+
+            self._matching_cells = 0
+
+        self._gravity()
+
+        marked = self._find_matches()
+
+        if marked:
+            self._occupied &= ~marked
+            self._matching_cells |= marked
+
+
+
+    def _find_matches(self) -> int:
+        '''
+        Returns the mask of cells in horizontal, vertical or either diagonal runs of three or more
+        '''
+        matchable = self._occupied | self._matching_cells
+        marked = 0
+
+        for mask in self._gems.values():
+            gems = mask & matchable
+
+            if not gems:
+                continue
+
+            for shift in (1, self._stride, self._stride - 1, self._stride + 1):
+                runs = gems & (gems >> shift) & (gems >> (2 * shift))
+
+                if runs:
+                    marked |= runs | (runs << shift) | (runs << (2 * shift))
+
+        return marked
+
+
+
+    def _update_faller_state(self) -> None:
+        '''
+        Updates states of fallers on the current game board
+        '''
+        state = None
+        target_row = self._faller.row_value() + 1
+
+        if self._solid_faller(target_row, self._faller.column_value()):
+            state = faller_stopped_cell
+            self._faller.state = faller_stopped
+
+        else:
+            state = faller_moving_cell
+            self._faller.state = faller_moving
+
+        for i in range(3):
+            row = self._faller.row_value() - i
+
+            if row < 0:
+                return
+
+            self._cell(row, self._faller.column_value(), self._faller.contents[i], state)
+
+
+
+    def _solid_faller(self, row: int, column: int) -> bool:
+        '''
+        Determines if faller is a solid or not
+        '''
+        if row >= self.number_of_rows():
+            return True
+
+        return bool(self._occupied & self._bit(row, column))
+
+
+
+    def _move_faller_down(self) -> None:
+        '''
+        Moves faller down
+        '''
+        if self._solid_faller(self._faller.row_value() + 1, self._faller.column_value()):
+            return
+
+        self._move_cell(self._faller.row_value(), self._faller.column_value(), down)
+
+        if self._faller.row_value() - 1 >= 0:
+            self._move_cell(self._faller.row_value() - 1, self._faller.column_value(), down)
+
+            if self._faller.row_value() - 2 >= 0:
+                self._move_cell(self._faller.row_value() - 2, self._faller.column_value(), down)
+
+            else:
+                self._cell(self._faller.row_value() - 1, self._faller.column_value(), self._faller.contents[2],
+                               faller_moving_cell)
+
+        else:
+            self._cell(self._faller.row_value(), self._faller.column_value(), self._faller.contents[1], faller_moving_cell)
+
+        self._faller.assign_row(self._faller.row_value() + 1)
+
+
+
+    def _move_cell(self, row: int, column: int, direction: int) -> None:
+        '''
+        Moves cell in specified direction
+        '''
+        bit = self._bit(row, column)
+
+        original_value = self._gem_at(bit)
+        original_state = self._state_at(bit)
+
+        self._set_gem(bit, empty)
+        self._set_state(bit, empty_cell)
+
+        if direction == down:
+            self._cell(row + 1, column, original_value, original_state)
+
+        else:
+            self._cell(row, column + direction, original_value, original_state)
@@ -0,0 +1,109 @@
+import argparse
+import csv
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import columns_sim as Sim
+
+
+result_fields = ['seed', 'ticks', 'cleared', 'max_chain', 'reason']
+
+
+def shard_path(directory: str, shard: int) -> str:
+    '''
+    Returns the result file of the specified shard
+    '''
+    return os.path.join(directory, 'shard-{:04d}.csv'.format(shard))
+
+
+
+def run_shard(shard: int, games: int, seed: int, directory: str, rows: int = 13, columns: int = 6, max_ticks: int = 100000) -> int:
+    '''
+    Plays the games of one shard and streams a result row per game to its file
+    Returns the number of games played
+    '''
+    generator = random.Random(seed)
+
+    with open(shard_path(directory, shard), 'w', newline='') as file:
+        writer = csv.DictWriter(file, result_fields)
+        writer.writeheader()
+
+        for i in range(games):
+            writer.writerow(Sim.play_game(generator.getrandbits(64), None, rows, columns, max_ticks))
+
+    return games
+
+
+
+def run_farm(games: int, directory: str, seed: int = None, workers: int = None, shards: int = None,
+             rows: int = 13, columns: int = 6, max_ticks: int = 100000) -> int:
+    '''
+    Spreads games over a pool of worker processes, one result file per shard
+    Returns the number of games played
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if shards is None:
+        shards = workers * 4
+
+    shards = max(1, min(shards, games))
+
+    os.makedirs(directory, exist_ok=True)
+
+    generator = random.Random(seed)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+
+        for shard in range(shards):
+            shard_games = games // shards + (1 if shard < games % shards else 0)
+            futures.append(executor.submit(run_shard, shard, shard_games, generator.getrandbits(64), directory, rows, columns, max_ticks))
+
+        return sum(future.result() for future in futures)
+
+
+
+def read_results(directory: str) -> [dict]:
+    '''
+    Reads every shard result file in the specified directory
+    '''
+    results = []
+
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('shard-') and name.endswith('.csv'):
+            with open(os.path.join(directory, name), newline='') as file:
+                results.extend(csv.DictReader(file))
+
+    return results
+
+
+
+def _main() -> None:
+    '''
+    Runs a self-play farm from the command line and reports the throughput
+    '''
+    parser = argparse.ArgumentParser(description='Runs headless Columns games on a process pool')
+    parser.add_argument('directory')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--shards', type=int, default=None)
+    parser.add_argument('--rows', type=int, default=13)
+    parser.add_argument('--columns', type=int, default=6)
+    parser.add_argument('--max-ticks', type=int, default=100000)
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    games = run_farm(arguments.games, arguments.directory, arguments.seed, arguments.workers, arguments.shards,
+                     arguments.rows, arguments.columns, arguments.max_ticks)
+    elapsed = time.perf_counter() - start
+
+    print('{} games in {:.2f}s ({:.0f} games/s)'.format(games, elapsed, games / elapsed))
+
+
+
+if __name__ == '__main__':
+    _main()
@@ -1,3 +1,11 @@
+import array
+import collections
+import csv
+import random
+import struct
+import time
+
+
 empty_cell = 'empty'
 faller_moving_cell = 'faller moving'
 faller_stopped_cell = 'faller stopped'
@@ -12,16 +20,169 @@ def matchable_state(state: str) -> bool:
     return state == occupied_cell or state == matching_cell
 
 
+empty_state = 0
+faller_moving_state = 1
+faller_stopped_state = 2
+occupied_state = 3
+matching_state = 4
+
+_state_names = [empty_cell, faller_moving_cell, faller_stopped_cell, occupied_cell, matching_cell]
+
+
+def _matchable(state: int) -> bool:
+    '''
+    Determines if matching is possible for an encoded state
+    Only the two highest state codes can be matched
+    '''
+    return state >= occupied_state
+
+
 left = -1
 right = 1
 down = 0
 down_left = 2
+down_right = 3
 
 
 none = 'none'
 empty = ' '
 
 
+cells_changed = 'cells changed'
+faller_moved = 'faller moved'
+faller_landed = 'faller landed'
+cells_matched = 'cells matched'
+cells_cleared = 'cells cleared'
+cells_fell = 'cells fell'
+
+gem_list = ['S', 'T', 'V', 'W', 'X', 'Y', 'Z']
+
+
+no_gem = -1
+empty_gem = 0
+
+_gem_names = [empty]
+_gem_codes = {empty: empty_gem}
+
+
+def gem_code(gem: str) -> int:
+    '''
+    Returns the integer code of the specified gem, assigning one if needed
+    '''
+    code = _gem_codes.get(gem)
+
+    if code is None:
+        code = len(_gem_names)
+
+        _gem_codes[gem] = code
+        _gem_names.append(gem)
+
+        _zobrist_grow(0)
+
+    return code
+
+
+
+def gem_name(code: int) -> str:
+    '''
+    Returns the gem for the specified integer code
+    '''
+    return _gem_names[code]
+
+
+_zobrist_gem_keys = []
+_zobrist_state_keys = []
+_zobrist_faller_keys = {}
+_zobrist_generators = {}
+
+def _zobrist_grow(cells: int) -> None:
+    '''
+    Makes sure every known gem and state has a Zobrist key for each of the specified number of cells
+    Each key list draws from its own fixed seed, so hashes are the same in every process
+    '''
+    if _zobrist_state_keys:
+        cells = max(cells, len(_zobrist_state_keys[0]))
+
+    for table, names, kind in ((_zobrist_gem_keys, _gem_names, 'gem'), (_zobrist_state_keys, _state_names, 'state')):
+        while len(table) < len(names):
+            table.append([])
+
+        for code in range(len(table)):
+            keys = table[code]
+
+            if code == 0:
+                keys.extend([0] * (cells - len(keys)))
+
+            else:
+                name = 'zobrist {} {}'.format(kind, code)
+                generator = _zobrist_generators.setdefault(name, random.Random(name))
+
+                keys.extend(generator.getrandbits(64) for i in range(cells - len(keys)))
+
+
+def _zobrist_faller_key(field: str, value: int) -> int:
+    '''
+    Returns the Zobrist key for the specified value of one faller field
+    Each field draws from its own fixed seed, as the cell keys do
+    '''
+    keys = _zobrist_faller_keys.setdefault(field, [])
+
+    if value >= len(keys):
+        name = 'zobrist faller {}'.format(field)
+        generator = _zobrist_generators.setdefault(name, random.Random(name))
+
+        keys.extend(generator.getrandbits(64) for i in range(value + 1 - len(keys)))
+
+    return keys[value]
+
+
+for gem in gem_list:
+    gem_code(gem)
+
+
+phase_methods = [
+    ('clock', 'clock'),
+    ('faller move', '_move_faller_down'),
+    ('faller state', '_update_faller_state'),
+    ('clear', '_clear_matched_cells'),
+    ('gravity', '_gravity'),
+    ('horizontal', '_match_horizontal'),
+    ('vertical', '_match_vertical'),
+    ('diagonal', '_match_diagonal'),
+    ('anti-diagonal', '_match_anti_diagonal')
+]
+
+phase_fields = ['calls', 'seconds', 'cells scanned', 'cells moved', 'matches marked']
+
+
+def write_phase_stats(stats: {str: {str: float}}, path: str) -> None:
+    '''
+    Writes the phase statistics of an instrumented game to a CSV file, one row per phase
+    '''
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['phase'] + phase_fields)
+
+        for phase, method in phase_methods:
+            writer.writerow([phase] + [stats[phase][field] for field in phase_fields])
+
+
+_snapshot_formats = {}
+
+
+def _snapshot_format(rows: int, columns: int) -> struct.Struct:
+    '''
+    Returns the packed layout of snapshots for the specified board size
+    '''
+    layout = _snapshot_formats.get((rows, columns))
+
+    if layout is None:
+        layout = struct.Struct('<HHBHHBBBBIIQ{0}s{0}s{1}H{1}H'.format(rows * columns, columns))
+        _snapshot_formats[(rows, columns)] = layout
+
+    return layout
+
+
 class GameState:
     def __init__(self, rows: int, columns: int):
         self._rows = rows
@@ -31,20 +192,35 @@ class GameState:
         self._board_states = []
         
         self._faller = Faller()
+        self._faller.contents = [empty_gem, empty_gem, empty_gem]
+
+        self._changed_cells = set()
+        self._matched_cells = []
+
+        self._column_tops = [rows] * columns
+        self._column_counts = [0] * columns
+
+        self._board_hash = 0
+        _zobrist_grow(rows * columns)
+
+        self._listeners = []
+
+        self._phase_stats = None
+        self._instrumented = False
+        self._cells_moved = 0
         
         for i in range(rows):
             row = []
             row_state = []
             
             for j in range(columns):
-                row.append(empty)
-                row_state.append(empty_cell)
+                row.append(empty_gem)
+                row_state.append(empty_state)
                 
             self._board_rows.append(row)
             self._board_states.append(row_state)
 
 
-
     def board_contents(self, contents: [[str]]) -> None:
         '''
         Assigns contents to game board
@@ -55,13 +231,16 @@ class GameState:
             for column in range(self.number_of_columns()):
                 value = contents[row][column]
                 
-                if value is empty:
-                    self._cell(row, column, empty, empty_cell)
+                if value == empty:
+                    self._cell(row, column, empty_gem, empty_state)
                     
                 else:
-                    self._cell(row, column, value, occupied_cell)
+                    self._cell(row, column, gem_code(value), occupied_state)
 
-        self._gravity()
+        if self._listeners:
+            self._publish(cells_changed, self._all_cells())
+
+        self._gravity(range(self.number_of_columns()))
         self._matching()
 
 
@@ -71,18 +250,13 @@ class GameState:
         Moves fallers down
         '''
         if self._faller.active:
+            cells = self._faller_cells() if self._listeners else None
+
             if self._faller.state == faller_stopped:
                 self._update_faller_state()
 
                 if self._faller.state == faller_stopped:
-                    value = False
-
-                    if self._faller.row_value() - 2 < 0:
-                        value = True
-
-                    for i in range(3):
-                        self._cell(self._faller.row_value() - i, self._faller.column_value(), self._faller.contents[i], occupied_cell)
-                    self._faller.active = False
+                    value = self._land_faller()
 
                     self._matching()
                     
@@ -92,6 +266,9 @@ class GameState:
 
             self._update_faller_state()
 
+            if cells is not None:
+                self._publish(faller_moved, cells + self._faller_cells())
+
         self._matching()
         
         return False
@@ -107,15 +284,73 @@ class GameState:
 
         self._faller.active = True
         
-        self._faller.contents = faller
+        self._faller.contents = [gem_code(gem) for gem in faller]
         
         self._faller.assign_row(0)
         self._faller.assign_column(column - 1)
         
-        self._cell(0, self._faller.column_value(), self._faller.contents[0], faller_moving_cell)
+        self._cell(0, self._faller.column_value(), self._faller.contents[0], faller_moving_state)
 
         self._update_faller_state()
 
+        if self._listeners:
+            self._publish(faller_moved, self._faller_cells())
+
+
+
+    def hard_drop(self) -> bool:
+        '''
+        Moves faller straight down to its landing row and lands it
+        While matches are still being cleared, faller falls a row per clock tick alongside them
+        Returns whether the landing ended the game, as clock does
+        '''
+        value = False
+
+        while self._faller.active and (self._matched_cells or self._changed_cells):
+            value = self.clock()
+
+        if not self._faller.active:
+            return value
+
+        row = self._faller.row_value()
+        column = self._faller.column_value()
+        landing_row = self._drop_row(row, column)
+
+        if landing_row != row:
+            cells = self._faller_cells() if self._listeners else None
+
+            for i in range(3):
+                self._cell(row - i, column, empty_gem, empty_state)
+
+            self._faller.assign_row(landing_row)
+
+            if cells is not None:
+                self._publish(faller_moved, cells + self._faller_cells())
+
+        value = self._land_faller()
+
+        self._matching()
+
+        return value
+
+
+
+    def settle(self) -> [[(int, int)]]:
+        '''
+        Clears matches and applies gravity until no cells match
+        Returns the cells cleared by each step of the chain
+        '''
+        steps = []
+
+        if not self._matched_cells:
+            self._matching()
+
+        while self._matched_cells:
+            steps.append(list(self._matched_cells))
+            self._matching()
+
+        return steps
+
 
 
     def active_faller(self) -> bool:
@@ -126,6 +361,244 @@ class GameState:
 
 
 
+    def faller_cells(self) -> [(int, int)]:
+        '''
+        Returns the cells of the active faller that are on the board, bottom first
+        '''
+        if not self._faller.active:
+            return []
+
+        return self._faller_cells()
+
+
+
+    def matched_cells(self) -> [(int, int)]:
+        '''
+        Returns the cells marked as matching by the last matching pass
+        '''
+        return list(self._matched_cells)
+
+
+
+    def subscribe(self, listener) -> None:
+        '''
+        Calls listener with every change event, a tuple of the event and the cells it touched
+        Nothing is collected while there are no listeners
+        '''
+        self._listeners.append(listener)
+
+
+
+    def unsubscribe(self, listener) -> None:
+        '''
+        Stops calling a listener added with subscribe
+        '''
+        self._listeners.remove(listener)
+
+
+
+    def instrument(self, enabled: bool = True) -> None:
+        '''
+        Turns timing and work counters for each phase of clock on or off
+        Phase methods are only wrapped on this game while it is on, so an uninstrumented game pays nothing
+        '''
+        for phase, method in phase_methods:
+            self.__dict__.pop(method, None)
+
+        self._instrumented = enabled
+
+        if not enabled:
+            return
+
+        if self._phase_stats is None:
+            self.reset_phase_stats()
+
+        for phase, method in phase_methods:
+            setattr(self, method, self._timed_phase(phase, getattr(self, method)))
+
+
+
+    def __getstate__(self) -> dict:
+        '''
+        Returns the attributes to copy or pickle, without the phase wrappers bound to this game
+        Listeners are not copied, so a copy starts with no subscribers
+        '''
+        state = dict(self.__dict__)
+        state['_listeners'] = []
+
+        for phase, method in phase_methods:
+            state.pop(method, None)
+
+        return state
+
+
+
+    def __setstate__(self, state: dict) -> None:
+        '''
+        Restores copied or pickled attributes and wraps the phases of the new game when the original was instrumented
+        '''
+        self.__dict__.update(state)
+
+        if self._instrumented:
+            self.instrument()
+
+
+
+    def phase_stats(self) -> {str: {str: float}}:
+        '''
+        Returns the calls, seconds and work counts recorded for each phase
+        '''
+        if self._phase_stats is None:
+            self.reset_phase_stats()
+
+        return {phase: dict(stats) for phase, stats in self._phase_stats.items()}
+
+
+
+    def reset_phase_stats(self) -> None:
+        '''
+        Sets every phase counter back to zero
+        '''
+        self._phase_stats = {phase: {field: 0 for field in phase_fields} for phase, method in phase_methods}
+
+
+
+    def position_hash(self) -> int:
+        '''
+        Returns the Zobrist hash of the board and active faller
+        Equal positions have equal hashes
+        '''
+        return self._board_hash ^ self._faller_hash()
+
+
+
+    def board_codes(self) -> (bytes, bytes):
+        '''
+        Returns the gem code and the state code of every cell, row by row
+        '''
+        return b''.join(bytes(row) for row in self._board_rows), b''.join(bytes(row) for row in self._board_states)
+
+
+
+    def snapshot(self) -> bytes:
+        '''
+        Returns the board, cell states and faller packed into immutable bytes
+        Gem codes are only shared between processes for gems in gem_list
+        '''
+        faller = self._faller
+        contents, states = self.board_codes()
+
+        cells = [row * self._columns + column for row, column in self._changed_cells]
+        cells.extend(row * self._columns + column for row, column in self._matched_cells)
+
+        snap = _snapshot_format(self._rows, self._columns).pack(
+            self._rows, self._columns, faller.active, faller.row_value(), faller.column_value(), faller.state,
+            faller.contents[0], faller.contents[1], faller.contents[2],
+            len(self._changed_cells), len(self._matched_cells), self._board_hash,
+            contents, states, *self._column_tops, *self._column_counts)
+
+        return snap + struct.pack('<{}I'.format(len(cells)), *cells)
+
+
+
+    def restore(self, snap: bytes) -> None:
+        '''
+        Returns the game to the position saved in a snapshot
+        '''
+        layout = _snapshot_format(self._rows, self._columns)
+        fields = layout.unpack_from(snap)
+
+        if fields[0] != self._rows or fields[1] != self._columns:
+            raise ValueError('snapshot is for a {}x{} board'.format(fields[0], fields[1]))
+
+        self._faller.active = bool(fields[2])
+        self._faller.assign_row(fields[3])
+        self._faller.assign_column(fields[4])
+        self._faller.state = fields[5]
+        self._faller.contents = list(fields[6:9])
+
+        self._board_hash = fields[11]
+
+        contents = fields[12]
+        states = fields[13]
+
+        self._board_rows = [list(contents[i:i + self._columns]) for i in range(0, len(contents), self._columns)]
+        self._board_states = [list(states[i:i + self._columns]) for i in range(0, len(states), self._columns)]
+
+        self._column_tops = list(fields[14:14 + self._columns])
+        self._column_counts = list(fields[14 + self._columns:])
+
+        cells = struct.unpack_from('<{}I'.format(fields[9] + fields[10]), snap, layout.size)
+        cells = [divmod(cell, self._columns) for cell in cells]
+
+        self._changed_cells = set(cells[:fields[9]])
+        self._matched_cells = cells[fields[9]:]
+
+        if self._listeners:
+            self._publish(cells_changed, self._all_cells())
+
+
+
+    def placements(self) -> ['Placement']:
+        '''
+        Returns every landing the active faller can reach, one per column and distinct rotation
+        Each landing is dropped straight onto its stack and settled, and the board is left as it was
+        '''
+        if not self._faller.active:
+            return []
+
+        base = self.snapshot()
+        listeners = self._listeners
+        self._listeners = []
+
+        row = self._faller.row_value()
+        columns = [self._faller.column_value()]
+
+        for direction in (left, right):
+            column = self._faller.column_value() + direction
+
+            while 0 <= column < self.number_of_columns() and not self._blocked_faller(row, column):
+                columns.append(column)
+                column += direction
+
+        rotations = []
+        contents = list(self._faller.contents)
+
+        for rotation in range(3):
+            if all(contents != other for other_rotation, other in rotations):
+                rotations.append((rotation, contents))
+
+            contents = [contents[1], contents[2], contents[0]]
+
+        for i in range(3):
+            self._cell(row - i, self._faller.column_value(), empty_gem, empty_state)
+
+        self._faller.active = False
+        self.settle()
+
+        settled = self.snapshot()
+        placements = []
+
+        for column in sorted(columns):
+            for rotation, contents in rotations:
+                self.restore(settled)
+
+                self._faller.contents = contents
+                self._faller.assign_row(self._landing_row(column))
+                self._faller.assign_column(column)
+
+                topped_out = self._land_faller()
+                cleared = sum(len(step) for step in self.settle())
+
+                placements.append(Placement(column + 1, rotation, topped_out, cleared, self._board_hash, self.snapshot()))
+
+        self.restore(base)
+        self._listeners = listeners
+
+        return placements
+
+
+
     def rotate(self) -> None:
         '''
         Rotates faller
@@ -144,6 +617,9 @@ class GameState:
             
         self._update_faller_state()
 
+        if self._listeners:
+            self._publish(faller_moved, self._faller_cells())
+
 
 
     def move_side(self, direction: int) -> None:
@@ -161,12 +637,10 @@ class GameState:
 
         target_move_column = self._faller.column_value() + direction
 
-        for i in range(3):
-            if self._faller.row_value() - i < 0:
-                break
+        if self._blocked_faller(self._faller.row_value(), target_move_column):
+            return
 
-            if self.current_cell_state(self._faller.row_value() - i, target_move_column) == occupied_cell:
-                return
+        cells = self._faller_cells() if self._listeners else None
 
         for i in range(3):
             if self._faller.row_value() - i < 0:
@@ -178,6 +652,9 @@ class GameState:
 
         self._update_faller_state()
 
+        if cells is not None:
+            self._publish(faller_moved, cells + self._faller_cells())
+
 
 
     def number_of_rows(self) -> int:
@@ -200,7 +677,7 @@ class GameState:
         '''
         Returns state of cell for the specified row and column
         '''
-        return self._board_states[row][column]
+        return _state_names[self._board_states[row][column]]
 
 
 
@@ -208,11 +685,11 @@ class GameState:
         '''
         Returns contents of cell for the specifid row and column
         '''
-        return self._board_rows[row][column]
+        return _gem_names[self._board_rows[row][column]]
 
 
 
-    def _cell(self, row: int, column: int, contents: str, state: str) -> None:
+    def _cell(self, row: int, column: int, contents: int, state: int) -> None:
         '''
         Sets characteristics of cell for specified row and column
         '''
@@ -225,78 +702,293 @@ class GameState:
 
 
 
-    def _cell_contents(self, row: int, column: int, contents: str) -> None:
+    def _cell_contents(self, row: int, column: int, contents: int) -> None:
         '''
         Sets contents of cell for specified row and column
         '''
         if row < 0:
             return
+
+        original_contents = self._board_rows[row][column]
+
+        if _matchable(self._board_states[row][column]) and original_contents != contents:
+            self._changed_cells.add((row, column))
+
+        index = row * self._columns + column
+        self._board_hash ^= _zobrist_gem_keys[original_contents][index] ^ _zobrist_gem_keys[contents][index]
         
         self._board_rows[row][column] = contents
 
 
 
-    def _cell_state(self, row: int, column: int, state: str) -> None:
+    def _cell_state(self, row: int, column: int, state: int) -> None:
         '''
         Sets state of cell for specified row and column
         '''
         if row < 0:
             return
+
+        original_state = self._board_states[row][column]
+
+        if _matchable(original_state) != _matchable(state):
+            self._changed_cells.add((row, column))
+
+        index = row * self._columns + column
+        self._board_hash ^= _zobrist_state_keys[original_state][index] ^ _zobrist_state_keys[state][index]
         
         self._board_states[row][column] = state
 
+        if (original_state == occupied_state) != (state == occupied_state):
+            self._update_column_height(row, column, state == occupied_state)
+
 
 
-    def _gravity(self) -> None:
+    def _publish(self, event: str, cells: [(int, int)]) -> None:
         '''
-        Gravity is applied to all cells until it reaches a solid cell
+        Passes a change event to every listener
         '''
-        for column in range(self.number_of_columns()):
-            for row in range(self.number_of_rows() - 1, -1, -1):
-                state = self.current_cell_state(row, column)
+        for listener in self._listeners:
+            listener((event, cells))
 
-                if state == faller_moving_cell or state == faller_stopped_cell:
-                    continue
-                
-                if state == occupied_cell:
-                    i = 1
-                    
-                    while not self._solid_faller(row + i, column):
-                        self._move_cell(row + i - 1, column, down)
-                        i += 1
+
+
+    def _all_cells(self) -> [(int, int)]:
+        '''
+        Returns every cell of the board
+        '''
+        return [(row, column) for row in range(self.number_of_rows()) for column in range(self.number_of_columns())]
+
+
+
+    def _faller_cells(self) -> [(int, int)]:
+        '''
+        Returns the cells of the faller that are on the board
+        '''
+        row = self._faller.row_value()
+        column = self._faller.column_value()
+
+        return [(row - i, column) for i in range(3) if row - i >= 0]
+
+
+
+    def _timed_phase(self, phase: str, method):
+        '''
+        Returns a wrapper of method that adds its time and work to the statistics of phase
+        '''
+        stats = self._phase_stats[phase]
+
+        def timed(*arguments):
+            scanned, moved = self._phase_work(phase, arguments)
+            matched = len(self._matched_cells)
+            fallen = self._cells_moved
+
+            start = time.perf_counter()
+            value = method(*arguments)
+            stats['seconds'] += time.perf_counter() - start
+
+            stats['calls'] += 1
+            stats['cells scanned'] += scanned
+            stats['cells moved'] += moved
+
+            if phase == 'gravity':
+                stats['cells moved'] += self._cells_moved - fallen
+
+            if phase in ('horizontal', 'vertical', 'diagonal', 'anti-diagonal'):
+                stats['matches marked'] += len(self._matched_cells) - matched
+
+            return value
+
+        return timed
+
+
+
+    def _phase_work(self, phase: str, arguments: tuple) -> (int, int):
+        '''
+        Returns how many cells a phase is about to scan and move
+        '''
+        rows = self.number_of_rows()
+        columns = self.number_of_columns()
+
+        if phase == 'faller move':
+            if self._solid_faller(self._faller.row_value() + 1, self._faller.column_value()):
+                return 1, 0
+
+            return 1, len(self._faller_cells())
+
+        if phase == 'faller state':
+            return len(self._faller_cells()), 0
+
+        if phase == 'clear':
+            return len(self._matched_cells), 0
+
+        if phase == 'gravity':
+            work = 0
+
+            for column in arguments[0]:
+                top = self._column_tops[column]
+
+                if self._column_counts[column] != rows - top:
+                    work += rows - top
+
+            return work, 0
+
+        if phase == 'horizontal':
+            return len(arguments[0]) * columns, 0
+
+        if phase == 'vertical':
+            return len(arguments[0]) * rows, 0
+
+        if phase == 'diagonal':
+            return sum(max(0, min(key, rows - 1) - max(0, key - columns + 1) + 1) for key in arguments[0]), 0
+
+        if phase == 'anti-diagonal':
+            return sum(max(0, min(rows - 1, columns - 1 + key) - max(0, key) + 1) for key in arguments[0]), 0
+
+        return 0, 0
+
+
+
+    def _faller_hash(self) -> int:
+        '''
+        Returns the hash contribution of the active faller
+        '''
+        if not self._faller.active:
+            return 0
+
+        faller = self._faller
+
+        value = (_zobrist_faller_key('row', faller.row_value()) ^ _zobrist_faller_key('column', faller.column_value())
+                 ^ _zobrist_faller_key('state', faller.state))
+
+        for i in range(3):
+            value ^= _zobrist_faller_key('gem {}'.format(i), faller.contents[i])
+
+        return value
+
+
+
+    def _update_column_height(self, row: int, column: int, occupied: bool) -> None:
+        '''
+        Updates the top of stack index after a cell becomes occupied or is vacated
+        '''
+        if occupied:
+            self._column_counts[column] += 1
+
+            if row < self._column_tops[column]:
+                self._column_tops[column] = row
+
+        else:
+            self._column_counts[column] -= 1
+
+            if row == self._column_tops[column]:
+                top = row + 1
+
+                while top < self.number_of_rows() and self._board_states[top][column] != occupied_state:
+                    top += 1
+
+                self._column_tops[column] = top
+
+
+
+    def _gravity(self, columns: {int}) -> None:
+        '''
+        Gravity is applied to the specified columns until cells reach a solid cell
+        Each column with a gap is compacted in a single pass
+        Every cell whose row changes is counted in _cells_moved
+        '''
+        fallen = [] if self._listeners else None
+
+        for column in columns:
+            top = self._column_tops[column]
+
+            if self._column_counts[column] == self.number_of_rows() - top:
+                continue
+
+            stack = []
+
+            for row in range(self.number_of_rows() - 1, top - 1, -1):
+                if self._board_states[row][column] == occupied_state:
+                    if row != self.number_of_rows() - 1 - len(stack):
+                        self._cells_moved += 1
+
+                    stack.append(self._board_rows[row][column])
+
+            row = self.number_of_rows() - 1
+
+            for contents in stack:
+                self._cell(row, column, contents, occupied_state)
+                row -= 1
+
+            while row >= top:
+                self._cell(row, column, empty_gem, empty_state)
+                row -= 1
+
+            if fallen is not None:
+                fallen.extend((row, column) for row in range(top, self.number_of_rows()))
+
+        if fallen:
+            self._publish(cells_fell, fallen)
 
 
 
     def _matching(self) -> None:
         '''
         Removes cells that are matching and applies gravity to remaining cells
+        Only lines through cells that changed since the last pass are checked
         '''
-        for row in range(self.number_of_rows()):
-            for column in range(self.number_of_columns()):
-                if self.current_cell_state(row, column) == matching_cell:
-                    self._cell(row, column, empty, empty_cell)
+        self._clear_matched_cells()
+
+        if not self._changed_cells:
+            return
 
-        self._gravity()
+        self._gravity({column for row, column in self._changed_cells})
 
-        self._match_horizontal()
-        self._match_vertical()
-        self._match_diagonal()
+        changed_cells = self._changed_cells
+        self._changed_cells = set()
 
+        self._match_horizontal({row for row, column in changed_cells})
+        self._match_vertical({column for row, column in changed_cells})
+        self._match_diagonal({row + column for row, column in changed_cells})
+        self._match_anti_diagonal({row - column for row, column in changed_cells})
 
+        if self._listeners and self._matched_cells:
+            self._publish(cells_matched, list(self._matched_cells))
 
-    def _match_horizontal(self) -> None:
+
+
+    def _clear_matched_cells(self) -> None:
+        '''
+        Empties the cells marked by the last matching pass
         '''
-        Checks if cells are matching horizontally
+        cleared = [] if self._listeners else None
+
+        for row, column in self._matched_cells:
+            if self._board_states[row][column] == matching_state:
+                self._cell(row, column, empty_gem, empty_state)
+
+                if cleared is not None:
+                    cleared.append((row, column))
+
+        if cleared:
+            self._publish(cells_cleared, cleared)
+
+        self._matched_cells = []
+
+
+
+    def _match_horizontal(self, rows: {int}) -> None:
         '''
-        for current_row in range(self.number_of_rows() - 1, -1, -1):
+        Checks if cells in the specified rows are matching horizontally
+        '''
+        for current_row in rows:
             matches = 0
-            jewel = none
+            jewel = no_gem
             
             for column in range(0, self.number_of_columns()):
-                contents = self.current_cell_contents(current_row, column)
-                state = self.current_cell_state(current_row, column)
+                contents = self._board_rows[current_row][column]
+                state = self._board_states[current_row][column]
                 
-                cell_match = (contents == jewel and matchable_state(state))
+                cell_match = (contents == jewel and _matchable(state))
 
                 if cell_match:
                     matches += 1
@@ -313,28 +1005,28 @@ class GameState:
                     if matches >= 3:
                         self._mark_matched_cells(current_row, column-1, left, matches)
 
-                    if matchable_state(state):
+                    if _matchable(state):
                         jewel = contents
                         matches = 1
                     else:
-                        jewel = none
+                        jewel = no_gem
                         matches = 1
 
 
 
-    def _match_vertical(self) -> None:
+    def _match_vertical(self, columns: {int}) -> None:
         '''
-        Checks if cells are matching vertically
+        Checks if cells in the specified columns are matching vertically
         '''
-        for current_column in range(0, self.number_of_columns()):
+        for current_column in columns:
             matches = 0
-            jewel = none
+            jewel = no_gem
             
             for row in range(self.number_of_rows() - 1, -1, -1):
-                contents = self.current_cell_contents(row, current_column)
-                state = self.current_cell_state(row, current_column)
+                contents = self._board_rows[row][current_column]
+                state = self._board_states[row][current_column]
                 
-                cell_match = (contents == jewel and matchable_state(state))
+                cell_match = (contents == jewel and _matchable(state))
 
                 if cell_match:
                     matches += 1
@@ -351,65 +1043,84 @@ class GameState:
                     if matches >= 3:
                         self._mark_matched_cells(row + 1, current_column, down, matches)
 
-                    if matchable_state(state):
+                    if _matchable(state):
                         jewel = contents
                         matches = 1
                         
                     else:
-                        jewel = none
+                        jewel = no_gem
                         matches = 1
 
 
 
-    def _match_diagonal(self) -> None:
+    def _match_diagonal(self, diagonals: {int}) -> None:
         '''
-        Checks if cells are matching diagonally
+        Checks if cells on the specified diagonals are matching from bottom left to top right
+        Each diagonal is identified by the sum of its row and column
         '''
-        for current_row in range(self.number_of_rows() - 1, -1, -1):
-            for current_column in range(0, self.number_of_columns()):
-                matches = 0
-                jewel = none
-                
-                row_count = 0
-                column_count = 0
-                
-                while True:
-                    row = current_row-row_count
-                    column = current_column+column_count
+        for diagonal in diagonals:
+            first_row = min(diagonal, self.number_of_rows() - 1)
+            last_row = max(diagonal - self.number_of_columns() + 1, 0)
+
+            cells = [(row, diagonal - row) for row in range(first_row, last_row - 1, -1)]
+
+            self._match_line(cells, down_left)
+
+
+
+    def _match_anti_diagonal(self, anti_diagonals: {int}) -> None:
+        '''
+        Checks if cells on the specified diagonals are matching from bottom right to top left
+        Each diagonal is identified by the difference of its row and column
+        '''
+        for anti_diagonal in anti_diagonals:
+            first_row = min(anti_diagonal + self.number_of_columns() - 1, self.number_of_rows() - 1)
+            last_row = max(anti_diagonal, 0)
+
+            cells = [(row, row - anti_diagonal) for row in range(first_row, last_row - 1, -1)]
+
+            self._match_line(cells, down_right)
 
-                    contents = self.current_cell_contents(row, column)
-                    state = self.current_cell_state(row, column)
-                    
-                    cell_match = (contents == jewel and matchable_state(state))
 
+
+    def _match_line(self, cells: [(int, int)], direction: int) -> None:
+        '''
+        Checks if consecutive cells along a line are matching
+        Direction points from each cell back towards the previous one
+        '''
+        matches = 0
+        jewel = no_gem
+
+        for i in range(len(cells)):
+            row, column = cells[i]
+
+            contents = self._board_rows[row][column]
+            state = self._board_states[row][column]
+
+            cell_match = (contents == jewel and _matchable(state))
+
+            if cell_match:
+                matches += 1
+
+            if i == len(cells) - 1:
+                if matches >= 3:
                     if cell_match:
-                        matches += 1
-
-                    if column == self.number_of_columns()-1 or row == 0:
-                        if matches >= 3:
-                            if cell_match:
-                                self._mark_matched_cells(row, column, down_left, matches)
-                                
-                            else:
-                                self._mark_matched_cells(row + 1, column - 1, down_left, matches)
-                                
-                    elif not cell_match:
-                        if matches >= 3:
-                            self._mark_matched_cells(row + 1, column - 1, down_left, matches)
-
-                        if matchable_state(state):
-                            jewel = contents
-                            matches = 1
-                            
-                        else:
-                            jewel = none
-                            matches = 1
+                        self._mark_matched_cells(row, column, direction, matches)
 
-                    row_count += 1
-                    column_count += 1
+                    else:
+                        self._mark_matched_cells(cells[i - 1][0], cells[i - 1][1], direction, matches)
 
-                    if current_row-row_count < 0 or current_column+column_count >= self.number_of_columns():
-                        break
+            elif not cell_match:
+                if matches >= 3:
+                    self._mark_matched_cells(cells[i - 1][0], cells[i - 1][1], direction, matches)
+
+                if _matchable(state):
+                    jewel = contents
+                    matches = 1
+
+                else:
+                    jewel = no_gem
+                    matches = 1
 
 
 
@@ -419,15 +1130,31 @@ class GameState:
         '''
         if direction == left:
             for target_column in range(column, column - amount, -1):
-                self._cell_state(row, target_column, matching_cell)
+                self._mark_matched_cell(row, target_column)
                 
         elif direction == down:
             for target_row in range(row, row + amount):
-                self._cell_state(target_row, column, matching_cell)
+                self._mark_matched_cell(target_row, column)
                 
         elif direction == down_left:
             for i in range(amount):
-                self._cell_state(row + i, column - i, matching_cell)
+                self._mark_matched_cell(row + i, column - i)
+
+        elif direction == down_right:
+            for i in range(amount):
+                self._mark_matched_cell(row + i, column + i)
+
+
+
+    def _mark_matched_cell(self, row: int, column: int) -> None:
+        '''
+        Determines that the specified cell is matching
+        '''
+        if self._board_states[row][column] == matching_state:
+            return
+
+        self._cell_state(row, column, matching_state)
+        self._matched_cells.append((row, column))
 
 
 
@@ -439,11 +1166,11 @@ class GameState:
         target_row = self._faller.row_value() + 1
         
         if self._solid_faller(target_row, self._faller.column_value()):
-            state = faller_stopped_cell
+            state = faller_stopped_state
             self._faller.state = faller_stopped
             
         else:
-            state = faller_moving_cell
+            state = faller_moving_state
             self._faller.state = faller_moving
 
         for i in range(3):
@@ -463,13 +1190,82 @@ class GameState:
         if row >= self.number_of_rows():
             return True
 
-        if self.current_cell_state(row, column) == occupied_cell:
+        top = self._column_tops[column]
+
+        if row < top:
+            return False
+
+        if self._column_counts[column] == self.number_of_rows() - top:
+            return True
+
+        return self._board_states[row][column] == occupied_state
+
+
+
+    def _blocked_faller(self, row: int, column: int) -> bool:
+        '''
+        Determines if a faller ending at the specified row would overlap a solid cell
+        '''
+        top = self._column_tops[column]
+
+        if row < top:
+            return False
+
+        if self._column_counts[column] == self.number_of_rows() - top:
             return True
 
+        for i in range(3):
+            if row - i < 0:
+                break
+
+            if self._board_states[row - i][column] == occupied_state:
+                return True
+
         return False
 
 
 
+    def _drop_row(self, row: int, column: int) -> int:
+        '''
+        Returns the row a faller ending at the specified row falls to in the specified column
+        '''
+        top = self._column_tops[column]
+
+        if self._column_counts[column] == self.number_of_rows() - top:
+            return max(row, top - 1)
+
+        while not self._solid_faller(row + 1, column):
+            row += 1
+
+        return row
+
+
+
+    def _land_faller(self) -> bool:
+        '''
+        Turns the faller into occupied cells where it is
+        Returns whether part of it is above the board
+        '''
+        for i in range(3):
+            self._cell(self._faller.row_value() - i, self._faller.column_value(), self._faller.contents[i], occupied_state)
+
+        self._faller.active = False
+
+        if self._listeners:
+            self._publish(faller_landed, self._faller_cells())
+
+        return self._faller.row_value() - 2 < 0
+
+
+
+    def _landing_row(self, column: int) -> int:
+        '''
+        Returns the row a faller above the stack comes to rest on in the specified column
+        '''
+        return self._column_tops[column] - 1
+
+
+
     def _move_faller_down(self) -> None:
         '''
         Moves faller down
@@ -487,10 +1283,10 @@ class GameState:
 
             else:
                 self._cell(self._faller.row_value() - 1, self._faller.column_value(), self._faller.contents[2],
-                               faller_moving_cell)
+                               faller_moving_state)
 
         else:
-            self._cell(self._faller.row_value(), self._faller.column_value(), self._faller.contents[1], faller_moving_cell)
+            self._cell(self._faller.row_value(), self._faller.column_value(), self._faller.contents[1], faller_moving_state)
 
         self._faller.assign_row(self._faller.row_value() + 1)
 
@@ -503,18 +1299,45 @@ class GameState:
         original_value = self._board_rows[row][column]
         original_state = self._board_states[row][column]
 
-        self._board_rows[row][column] = empty
-        self._board_states[row][column] = empty_cell
-
         if direction == down:
             target_row = row + 1
-            self._board_rows[target_row][column] = original_value
-            self._board_states[target_row][column] = original_state
+            target_column = column
 
         else:
+            target_row = row
             target_column = column + direction
-            self._board_rows[row][target_column] = original_value
-            self._board_states[row][target_column] = original_state
+
+        target_state = self._board_states[target_row][target_column]
+
+        if _matchable(original_state):
+            self._changed_cells.add((row, column))
+            self._changed_cells.add((target_row, target_column))
+
+        elif _matchable(target_state):
+            self._changed_cells.add((target_row, target_column))
+
+        index = row * self._columns + column
+        target_index = target_row * self._columns + target_column
+        target_value = self._board_rows[target_row][target_column]
+
+        self._board_hash ^= (_zobrist_gem_keys[original_value][index] ^ _zobrist_state_keys[original_state][index]
+                             ^ _zobrist_gem_keys[target_value][target_index] ^ _zobrist_state_keys[target_state][target_index]
+                             ^ _zobrist_gem_keys[original_value][target_index] ^ _zobrist_state_keys[original_state][target_index])
+
+        self._board_rows[row][column] = empty_gem
+        self._board_states[row][column] = empty_state
+
+        self._board_rows[target_row][target_column] = original_value
+        self._board_states[target_row][target_column] = original_state
+
+        if original_state == occupied_state:
+            if target_state != occupied_state:
+                self._update_column_height(target_row, target_column, True)
+
+            self._update_column_height(row, column, False)
+
+        elif target_state == occupied_state:
+            self._update_column_height(target_row, target_column, False)
 
 
 faller_stopped = 0
@@ -562,3 +1385,92 @@ class Faller:
         Assigns the column value for faller
         '''
         self._column = column
+
+
+
+class Placement:
+    '''
+    Settled result of dropping the faller in one column and rotation
+    The column is numbered from one as in generate_faller, and rotation
+    counts the calls to rotate; pass snapshot to restore to play it
+    '''
+    def __init__(self, column: int, rotation: int, topped_out: bool, cleared: int, board_hash: int, snapshot: bytes):
+        self.column = column
+        self.rotation = rotation
+        self.topped_out = topped_out
+        self.cleared = cleared
+        self.board_hash = board_hash
+        self.snapshot = snapshot
+
+
+
+class PieceSource:
+    '''
+    Seeded stream of fallers with a preview queue
+    Each piece is a column numbered from one and three gems, drawn
+    in the same order as random.sample and random.randint would
+    '''
+    def __init__(self, columns: int, seed: int = None, preview: int = 1, gems: [str] = None):
+        self._columns = columns
+        self._random = random.Random(seed)
+        self._preview = preview
+        self._gems = list(gem_list if gems is None else gems)
+
+        self._queue = collections.deque()
+
+        self._fill(preview)
+
+
+
+    def next_piece(self) -> (int, [str, str, str]):
+        '''
+        Removes and returns the next piece, keeping the preview queue full
+        '''
+        self._fill(1)
+        piece = self._queue.popleft()
+        self._fill(self._preview)
+
+        return piece
+
+
+
+    def preview(self, count: int = None) -> [(int, [str, str, str])]:
+        '''
+        Returns the upcoming pieces without removing them
+        '''
+        if count is None:
+            count = self._preview
+
+        self._fill(count)
+
+        return [self._queue[i] for i in range(count)]
+
+
+
+    def pieces_array(self, count: int) -> array.array:
+        '''
+        Generates the next count pieces ahead of time without removing them
+        Returns them as unsigned shorts, a column and three gem codes per piece
+        '''
+        self._fill(count)
+
+        pieces = array.array('H')
+
+        for i in range(count):
+            column, contents = self._queue[i]
+            pieces.append(column)
+            pieces.extend(gem_code(gem) for gem in contents)
+
+        return pieces
+
+
+
+    def _fill(self, count: int) -> None:
+        '''
+        Draws pieces until at least count are queued
+        '''
+        while len(self._queue) < count:
+            contents = self._random.sample(self._gems, 3)
+            column = self._random.randint(1, self._columns)
+
+            self._queue.append((column, contents))
@@ -1,14 +1,19 @@
 import pygame
 from pygame import mixer
 import columns_game as Game
-import random
 
 
 board_rows = 13
 board_columns = 6
-clock_time = 14
+step_rate = 60
+step_time = 1.0 / step_rate
+max_steps = 15
+clock_time = 60
+frame_rate = 120
+key_repeat_delay = 150
+key_repeat_interval = 70
 
-gem_list = ['S', 'T', 'V', 'W', 'X', 'Y', 'Z']
+gem_list = Game.gem_list
 
 
 def _determine_gem_color(gem: str) -> (int, int, int):
@@ -38,13 +43,43 @@ def _determine_gem_color(gem: str) -> (int, int, int):
 
 
 
+class Layout:
+    '''
+    Pixel areas of the board and of each of its cells for one window size
+    '''
+    def __init__(self, board_rect: pygame.Rect, cell_rects: [[pygame.Rect]]):
+        self.board_rect = board_rect
+        self.cell_rects = cell_rects
+        self.cell_size = cell_rects[0][0].size
+        self.cells_rect = cell_rects[0][0].union(cell_rects[-1][-1])
+
+
+
 class PyGame:
-    def __init__(self):
+    def __init__(self, indexed: bool = False):
         state = Game.GameState(board_rows, board_columns)
 
+        self._events = hasattr(state, 'subscribe')
+
+        if self._events:
+            state.subscribe(self._handle_game_event)
+
         self._state = state
+        self._pieces = Game.PieceSource(board_columns)
         self._clock_time = clock_time
         self._running = True
+        self._falling = False
+
+        self._dirty_cells = set()
+        self._redraw = True
+
+        self._faller_offset = 0
+        self._offset_cells = []
+        self._offset_gems = set()
+        self._uncovered_rects = []
+
+        self._indexed = indexed and hasattr(state, 'board_codes')
+        self._interpolated = self._events and not self._indexed and hasattr(state, 'faller_cells')
 
         self._background_color = pygame.Color(205, 187, 167)
         self._board_color = pygame.Color(218, 208, 194)
@@ -58,6 +93,8 @@ class PyGame:
     def start_game(self) -> None:
         '''
         Main function that starts the game
+        The game advances in fixed steps of step_time, with a clock tick every clock_time steps,
+        while frames are drawn as often as frame_rate allows
         '''
         pygame.init()
 
@@ -66,24 +103,26 @@ class PyGame:
 
             self._define_surface((600, 600))
 
+            pygame.key.set_repeat(key_repeat_delay, key_repeat_interval)
+
             mixer.music.load('background_music.wav')
             mixer.music.set_volume(0.5)
             mixer.music.play(-1)
 
             self._match_sound = pygame.mixer.Sound('matching.wav')
 
+            lag = 0.0
+
             while self._running:
-                clock.tick(clock_time)
+                lag = min(lag + clock.tick(frame_rate) / 1000, step_time * max_steps)
 
                 self._handle_events()
 
-                self._clock_time -= 1
-
-                if self._clock_time == 0:
-                    self._game_time()
-                    self._clock_time = clock_time
+                while lag >= step_time and self._running:
+                    self._step()
+                    lag -= step_time
 
-                self._draw_frame()
+                self._draw_frame(lag / step_time)
 
 
         finally:
@@ -91,41 +130,157 @@ class PyGame:
 
 
 
+    def _step(self) -> None:
+        '''
+        Advances the game by one fixed step
+        A backend without change events is redrawn in full after every step
+        '''
+        self._clock_time -= 1
+
+        if self._clock_time == 0:
+            self._game_time()
+            self._clock_time = clock_time
+
+        if not self._events:
+            self._redraw = True
+
+
+
     def _game_time(self) -> None:
         '''
         Generates faller while game is running
         '''
+        if self._interpolated:
+            before = self._state.faller_cells()
+
         self._running = not self._state.clock()
 
+        if self._interpolated:
+            after = self._state.faller_cells()
+            self._falling = bool(before) and bool(after) and after[0] == (before[0][0] + 1, before[0][1])
+
+        elif not self._events and self._matching_cells():
+            self._match_sound.play()
+
         if not self._state.active_faller():
-            contents = random.sample(gem_list, 3)
-            column = random.randint(1, board_columns)
+            column, contents = self._pieces.next_piece()
 
             self._state.generate_faller(column, contents)
 
 
+
+    def _matching_cells(self) -> bool:
+        '''
+        Determines if any cell is matching, for backends that do not publish change events
+        '''
+        for row in range(self._state.number_of_rows()):
+            for column in range(self._state.number_of_columns()):
+                if self._state.current_cell_state(row, column) == Game.matching_cell:
+                    return True
+
+        return False
+
+
+
+    def _handle_game_event(self, event: (str, [(int, int)])) -> None:
+        '''
+        Marks the cells of a game event for redrawing
+        Plays the match sound once for each group of cells that starts matching
+        '''
+        self._dirty_cells.update(event[1])
+
+        if event[0] == Game.cells_matched:
+            self._match_sound.play()
+
+
+
     def _define_surface(self, size: (int, int)) -> None:
         '''
         Defines the surface window of the game
         '''
         self._surface = pygame.display.set_mode(size, pygame.RESIZABLE)
+        self._redraw = True
+
+        cell_rects = []
+
+        for row in range(self._state.number_of_rows()):
+            cell_rects.append([self._cell_rect(row, column) for column in range(self._state.number_of_columns())])
+
+        self._layout = Layout(self._board_rect(), cell_rects)
+
+        if self._indexed:
+            self._build_indexed_board()
+
+        else:
+            self._build_sprites()
+
+
+
+    def _build_sprites(self) -> None:
+        '''
+        Pre-renders every gem in each of its looks at the current cell size
+        '''
+        size = self._layout.cell_size
+
+        self._sprites = {}
+
+        for gem in gem_list:
+            for state in (Game.occupied_cell, Game.faller_stopped_cell, Game.matching_cell):
+                sprite = pygame.Surface(size).convert()
+
+                if state == Game.matching_cell:
+                    sprite.fill(pygame.Color(255, 255, 255))
+
+                else:
+                    sprite.fill(pygame.Color(*_determine_gem_color(gem)))
+
+                if state == Game.faller_stopped_cell:
+                    pygame.draw.rect(sprite, pygame.Color(255, 255, 255), sprite.get_rect(), 2)
+
+                self._sprites[(gem, state)] = sprite
+
+
+
+    def _build_indexed_board(self) -> None:
+        '''
+        Creates the one pixel per cell surface and its palette
+        Index 0 is the board and gem codes are normal gems, then stopped and matching gems
+        each follow one stride further on, the stride being one more than the largest gem code
+        '''
+        self._board_image = pygame.Surface((self._state.number_of_columns(), self._state.number_of_rows()), 0, 8)
+
+        stride = max(Game.gem_code(gem) for gem in gem_list) + 1
+
+        self._palette_stride = stride
+        self._palette_offsets = bytes(stride if code == Game.faller_stopped_state else 2 * stride if code == Game.matching_state else 0
+                                      for code in range(256))
+
+        palette = [self._board_color] * 256
+
+        for gem in gem_list:
+            code = Game.gem_code(gem)
+            color = pygame.Color(*_determine_gem_color(gem))
+
+            palette[code] = color
+            palette[code + stride] = color.lerp(pygame.Color(255, 255, 255), 0.5)
+            palette[code + 2 * stride] = pygame.Color(255, 255, 255)
+
+        self._board_image.set_palette(palette)
 
 
 
     def _handle_events(self) -> None:
         '''
-        Handles the key events
+        Handles the window events
         '''
         for event in pygame.event.get():
             self._handle_event(event)
 
-        self._handle_keys()
-
 
 
     def _handle_event(self, event: pygame.event.EventType) -> None:
         '''
-        Handles when to quit or resize video
+        Handles when to quit, resize video or move the faller
         '''
         if event.type == pygame.QUIT:
             self._running = False
@@ -133,33 +288,77 @@ class PyGame:
         elif event.type == pygame.VIDEORESIZE:
             self._define_surface(event.size)
 
+        elif event.type == pygame.KEYDOWN:
+            self._handle_key(event.key)
 
 
-    def _handle_keys(self) -> None:
+
+    def _handle_key(self, key: int) -> None:
         '''
-        Handles what to do depending on what keys are pressed
+        Handles what to do when a key is pressed or repeats while held
+        Keys are handled as soon as they arrive, so even a short tap moves the faller
         '''
-        keys = pygame.key.get_pressed()
-
-        if keys[pygame.K_LEFT]:
+        if key == pygame.K_LEFT:
             self._state.move_side(Game.left)
 
-        if keys[pygame.K_RIGHT]:
+        elif key == pygame.K_RIGHT:
             self._state.move_side(Game.right)
 
-        if keys[pygame.K_SPACE]:
+        elif key == pygame.K_SPACE:
             self._state.rotate()
 
+        else:
+            return
+
+        if not self._events:
+            self._redraw = True
 
 
-    def _draw_frame(self) -> None:
+
+    def _draw_frame(self, alpha: float = 0.0) -> None:
         '''
         Displays the current frame of the game
+        Only cells changed since the last frame are redrawn and presented
+        alpha is how far the game is through the current step, used to place a falling faller
         '''
-        self._surface.fill(self._background_color)
-        self._draw_game_objects()
+        if self._interpolated:
+            self._place_faller(alpha)
+
+        if self._redraw:
+            self._surface.fill(self._background_color)
+
+            if self._indexed:
+                pygame.draw.rect(self._surface, self._board_color, self._layout.board_rect, 0)
+                self._draw_indexed_board()
+
+            else:
+                self._draw_game_objects()
+
+            pygame.display.flip()
 
-        pygame.display.flip()
+            self._redraw = False
+            self._dirty_cells.clear()
+            self._uncovered_rects.clear()
+
+            return
+
+        if not self._dirty_cells:
+            return
+
+        if self._indexed:
+            rects = [self._draw_indexed_board()]
+
+        else:
+            rects = [self._draw_area(rect) for rect in self._uncovered_rects]
+            rects.extend(self._draw_cell(row, column) for row, column in self._dirty_cells)
+
+            if self._faller_offset:
+                self._draw_offset_faller()
+
+        self._dirty_cells.clear()
+        self._uncovered_rects.clear()
+
+        pygame.display.update(rects)
 
 
 
@@ -167,42 +366,165 @@ class PyGame:
         '''
         Displays the objects of the game
         '''
-        top_left_x = self._frac_x_to_pixel_x((self._gem_buffer_x / 2))
-        top_left_y = self._frac_y_to_pixel_y((self._gem_buffer_y / 2))
-
-        width = self._frac_x_to_pixel_x((self._gem_size * self._state.number_of_columns()) - 0.001)
-        height = self._frac_y_to_pixel_y((self._gem_size * self._state.number_of_rows()))
-
-        outline_rect = pygame.Rect(top_left_x, top_left_y, width, height)
-        pygame.draw.rect(self._surface, self._board_color, outline_rect, 0)
+        pygame.draw.rect(self._surface, self._board_color, self._layout.board_rect, 0)
 
         for row in range(self._state.number_of_rows()):
             for column in range(self._state.number_of_columns()):
-                self._draw_gem(row, column)
+                if (row, column) not in self._offset_gems:
+                    self._draw_gem(row, column)
+
+        if self._faller_offset:
+            self._draw_offset_faller()
+
+
+
+    def _place_faller(self, alpha: float) -> None:
+        '''
+        Works out how far above its cells a falling faller is drawn, so it slides down between clock ticks
+        Marks the cells it covered and now covers for redrawing whenever that changes, and the
+        whole area it covered, since a raised gem also paints the gaps between cells
+        '''
+        offset = 0
+        cells = []
+        gems = set()
+
+        if self._falling:
+            progress = (clock_time - self._clock_time + alpha) / clock_time
+            offset = int((1.0 - min(progress, 1.0)) * self._layout.cell_size[1])
+
+        if offset:
+            cells = self._state.faller_cells()
+            gems = set(cells)
+
+            if cells and cells[-1][0] > 0:
+                cells.append((cells[-1][0] - 1, cells[-1][1]))
+
+        if offset != self._faller_offset or cells != self._offset_cells:
+            if self._offset_cells:
+                rects = [self._layout.cell_rects[row][column] for row, column in self._offset_cells]
+                self._uncovered_rects.append(rects[0].unionall(rects[1:]))
+
+            self._dirty_cells.update(self._offset_cells)
+            self._dirty_cells.update(cells)
+
+            self._faller_offset = offset
+            self._offset_cells = cells
+            self._offset_gems = gems
+
+
+
+    def _draw_offset_faller(self) -> None:
+        '''
+        Displays the gems of the falling faller raised by its offset, kept inside the board
+        '''
+        self._surface.set_clip(self._layout.cells_rect)
+
+        for row, column in self._offset_gems:
+            self._draw_gem(row, column, self._faller_offset)
+
+        self._surface.set_clip(None)
+
+
+
+    def _draw_indexed_board(self) -> pygame.Rect:
+        '''
+        Writes one palette index per cell into the board image and scales it over the board in one blit
+        Returns the area that changed
+        '''
+        contents, states = self._state.board_codes()
+        code = max(contents)
 
+        if code >= self._palette_stride:
+            raise ValueError('gem {} has no color in the indexed palette'.format(Game.gem_name(code)))
 
+        # Gem codes stay below the stride, so adding the offsets as big integers never carries between cells
+        indexes = int.from_bytes(contents, 'big') + int.from_bytes(states.translate(self._palette_offsets), 'big')
+        indexes = indexes.to_bytes(len(contents), 'big')
 
-    def _draw_gem(self, row: int, column: int) -> None:
+        columns = self._state.number_of_columns()
+        pitch = self._board_image.get_pitch()
+        buffer = self._board_image.get_buffer()
+
+        if pitch == columns:
+            buffer.write(indexes, 0)
+
+        else:
+            for row in range(self._state.number_of_rows()):
+                buffer.write(indexes[row * columns:(row + 1) * columns], row * pitch)
+
+        del buffer
+
+        rect = self._layout.cells_rect
+        self._surface.blit(pygame.transform.scale(self._board_image, rect.size), rect)
+
+        return rect
+
+
+
+    def _draw_cell(self, row: int, column: int) -> pygame.Rect:
+        '''
+        Redraws the board behind the specified cell and its gem
+        Returns the area that changed
+        '''
+        rect = self._draw_area(self._layout.cell_rects[row][column])
+
+        if (row, column) not in self._offset_gems:
+            self._draw_gem(row, column)
+
+        return rect
+
+
+
+    def _draw_area(self, rect: pygame.Rect) -> pygame.Rect:
+        '''
+        Redraws the background and board inside the specified area
+        Returns the area
+        '''
+        self._surface.fill(self._background_color, rect)
+        self._surface.fill(self._board_color, rect.clip(self._layout.board_rect))
+
+        return rect
+
+
+
+    def _draw_gem(self, row: int, column: int, offset: int = 0) -> None:
         '''
-        Displays the specified gem
+        Displays the specified gem, raised by offset pixels
         '''
         gem = self._state.current_cell_contents(row, column)
 
-        if gem is Game.empty:
+        if gem == Game.empty:
             return
 
-        raw_color = None
         state = self._state.current_cell_state(row, column)
 
-        if state == Game.matching_cell:
-            raw_color = (255, 255, 255)
-            self._match_sound.play()
+        if state != Game.matching_cell and state != Game.faller_stopped_cell:
+            state = Game.occupied_cell
 
-        else:
-            raw_color = _determine_gem_color(gem)
+        self._surface.blit(self._sprites[(gem, state)], self._layout.cell_rects[row][column].move(0, -offset))
+
+
+
+    def _board_rect(self) -> pygame.Rect:
+        '''
+        Returns the pixel area of the board
+        Only used to build the layout when the surface is defined
+        '''
+        top_left_x = self._frac_x_to_pixel_x((self._gem_buffer_x / 2))
+        top_left_y = self._frac_y_to_pixel_y((self._gem_buffer_y / 2))
+
+        width = self._frac_x_to_pixel_x((self._gem_size * self._state.number_of_columns()) - 0.001)
+        height = self._frac_y_to_pixel_y((self._gem_size * self._state.number_of_rows()))
+
+        return pygame.Rect(top_left_x, top_left_y, width, height)
 
-        color = pygame.Color(raw_color[0], raw_color[1], raw_color[2])
 
+
+    def _cell_rect(self, row: int, column: int) -> pygame.Rect:
+        '''
+        Returns the pixel area of the specified cell
+        Only used to build the layout when the surface is defined
+        '''
         gem_x = (column * self._gem_size) + (self._gem_buffer_x / 2)
         gem_y = (row * self._gem_size) + (self._gem_buffer_y / 2)
 
@@ -212,12 +534,7 @@ class PyGame:
         width = self._frac_x_to_pixel_x(self._gem_size)
         height = self._frac_y_to_pixel_y(self._gem_size)
 
-        rect = pygame.Rect(top_left_x, top_left_y, width, height)
-
-        pygame.draw.rect(self._surface, color, rect, 0)
-
-        if state == Game.faller_stopped_cell:
-            pygame.draw.rect(self._surface, pygame.Color(255, 255, 255), rect, 2)
+        return pygame.Rect(top_left_x, top_left_y, width, height)
 
 
     def _frac_x_to_pixel_x(self, frac_x: float) -> int:
@@ -0,0 +1,411 @@
+import argparse
+import struct
+import time
+import zlib
+
+import columns_game as Game
+
+
+_magic = b'CLRP'
+_version = 2
+
+_header = struct.Struct('<4sBHHQ')
+_digest = struct.Struct('<I')
+
+_op_shift = 5
+_count_mask = (1 << _op_shift) - 1
+
+_clock_op = 0
+_left_op = 1
+_right_op = 2
+_rotate_op = 3
+_drop_op = 4
+_faller_op = 5
+_gem_op = 6
+_end_op = 7
+
+_end_input = 0
+_restore_input = 1
+_contents_input = 2
+_settle_input = 3
+
+_repeated_ops = {_clock_op, _left_op, _right_op, _rotate_op}
+
+_forwarded = {
+    'active_faller', 'faller_cells', 'matched_cells', 'number_of_rows', 'number_of_columns',
+    'current_cell_state', 'current_cell_contents', 'board_codes', 'snapshot', 'position_hash', 'placements',
+    'subscribe', 'unsubscribe', 'instrument', 'phase_stats', 'reset_phase_stats'
+}
+
+
+def _write_varint(buffer: bytearray, value: int) -> None:
+    '''
+    Appends an unsigned integer seven bits at a time
+    '''
+    while value > 0x7f:
+        buffer.append(0x80 | (value & 0x7f))
+        value >>= 7
+
+    buffer.append(value)
+
+
+
+def _read_varint(data: bytes, index: int) -> (int, int):
+    '''
+    Reads an unsigned integer written by _write_varint
+    Returns the value and the index after it
+    '''
+    value = 0
+    shift = 0
+
+    while True:
+        byte = data[index]
+        index += 1
+
+        value |= (byte & 0x7f) << shift
+        shift += 7
+
+        if byte < 0x80:
+            return value, index
+
+
+
+def board_digest(state: Game.GameState) -> int:
+    '''
+    Returns a checksum of the contents and state of every cell
+    It only depends on gem names, so it is the same in every process
+    '''
+    cells = []
+
+    for row in range(state.number_of_rows()):
+        for column in range(state.number_of_columns()):
+            cells.append(state.current_cell_contents(row, column))
+            cells.append(state.current_cell_state(row, column))
+
+    return zlib.crc32('\0'.join(cells).encode())
+
+
+
+class Recorder:
+    '''
+    Game state wrapper that records every input as it is applied
+
+    Inputs are stored one byte each, with the operation in the high three
+    bits and a repeat count in the low five, so a run of clock ticks or
+    moves costs a single byte. Fallers store their column and three gem
+    codes, and each gem name is written once when it is first used.
+    Restores, whole boards and settles share the end operation and are told
+    apart by its low bits. Only queries that leave the game as it is are
+    passed through to the wrapped state without being recorded.
+    '''
+    def __init__(self, state: Game.GameState, seed: int = 0):
+        self._state = state
+        self._ticks = 0
+
+        self._data = bytearray(_header.pack(_magic, _version, state.number_of_rows(), state.number_of_columns(), seed))
+        self._last = None
+
+        self._gem_codes = {}
+
+
+
+    def __getattr__(self, name: str):
+        if name not in _forwarded:
+            raise AttributeError('{} has no attribute {!r}'.format(type(self).__name__, name))
+
+        return getattr(self._state, name)
+
+
+
+    def clock(self) -> bool:
+        '''
+        Records a clock tick and moves fallers down
+        '''
+        self._ticks += 1
+        self._record(_clock_op)
+
+        return self._state.clock()
+
+
+
+    def move_side(self, direction: int) -> None:
+        '''
+        Records a move and moves faller in specified direction when not blocked
+        '''
+        if direction == Game.left:
+            self._record(_left_op)
+
+        elif direction == Game.right:
+            self._record(_right_op)
+
+        self._state.move_side(direction)
+
+
+
+    def rotate(self) -> None:
+        '''
+        Records a rotation and rotates faller
+        '''
+        self._record(_rotate_op)
+        self._state.rotate()
+
+
+
+    def hard_drop(self) -> bool:
+        '''
+        Records a hard drop and lands faller on its stack
+        '''
+        self._record(_drop_op)
+
+        return self._state.hard_drop()
+
+
+
+    def restore(self, snap: bytes) -> None:
+        '''
+        Records a snapshot and restores the game to it
+        '''
+        self._data.append((_end_op << _op_shift) | _restore_input)
+        _write_varint(self._data, len(snap))
+        self._data.extend(snap)
+        self._last = None
+
+        self._state.restore(snap)
+
+
+
+    def board_contents(self, contents: [[str]]) -> None:
+        '''
+        Records the gems of every cell and sets the board to them
+        '''
+        codes = [self._gem_code(gem) for row in contents for gem in row]
+
+        self._data.append((_end_op << _op_shift) | _contents_input)
+        _write_varint(self._data, len(contents))
+        _write_varint(self._data, len(contents[0]) if contents else 0)
+        self._data.extend(codes)
+        self._last = None
+
+        self._state.board_contents(contents)
+
+
+
+    def settle(self) -> [[(int, int)]]:
+        '''
+        Records a settle and clears matches until no cells match
+        '''
+        self._data.append((_end_op << _op_shift) | _settle_input)
+        self._last = None
+
+        return self._state.settle()
+
+
+
+    def generate_faller(self, column: int, faller: [str, str, str]) -> None:
+        '''
+        Records the column and contents of a faller and generates it
+        '''
+        codes = [self._gem_code(gem) for gem in faller]
+
+        self._data.append(_faller_op << _op_shift)
+        _write_varint(self._data, column)
+        self._data.extend(codes)
+        self._last = None
+
+        self._state.generate_faller(column, faller)
+
+
+
+    def finish(self) -> bytes:
+        '''
+        Returns the recorded bytes, ended with the tick count and a digest of the current board
+        Recording can go on afterwards
+        '''
+        data = bytearray(self._data)
+
+        data.append(_end_op << _op_shift)
+        _write_varint(data, self._ticks)
+        data.extend(_digest.pack(board_digest(self._state)))
+
+        return bytes(data)
+
+
+
+    def _record(self, op: int) -> None:
+        '''
+        Appends an input, folding it into the previous byte when it repeats
+        '''
+        if self._last == op and self._data[-1] & _count_mask < _count_mask:
+            self._data[-1] += 1
+
+        else:
+            self._data.append(op << _op_shift)
+            self._last = op if op in _repeated_ops else None
+
+
+
+    def _gem_code(self, gem: str) -> int:
+        '''
+        Returns the recording code of a gem, writing its name the first time it is used
+        '''
+        code = self._gem_codes.get(gem)
+
+        if code is None:
+            code = len(self._gem_codes)
+
+            if code > 0xff:
+                raise ValueError('too many different gems for a replay')
+
+            name = gem.encode()
+
+            self._data.append(_gem_op << _op_shift)
+            _write_varint(self._data, len(name))
+            self._data.extend(name)
+            self._last = None
+
+            self._gem_codes[gem] = code
+
+        return code
+
+
+
+def read_header(data: bytes) -> dict:
+    '''
+    Returns the board size and seed of a recording
+    '''
+    magic, version, rows, columns, seed = _header.unpack_from(data)
+
+    if magic != _magic:
+        raise ValueError('not a Columns replay')
+
+    if version > _version:
+        raise ValueError('unsupported replay version {}'.format(version))
+
+    return {'rows': rows, 'columns': columns, 'seed': seed}
+
+
+
+def replay(data: bytes, state: Game.GameState = None) -> Game.GameState:
+    '''
+    Runs every input of a recording through a game state as fast as possible
+    Raises ValueError when the final board does not match the recorded one
+    '''
+    header = read_header(data)
+
+    if state is None:
+        state = Game.GameState(header['rows'], header['columns'])
+
+    index, ticks = play_inputs(state, data, _header.size, [])
+
+    if index >= len(data):
+        raise ValueError('replay has no end record')
+
+    recorded_ticks, index = _read_varint(data, index + 1)
+    digest, = _digest.unpack_from(data, index)
+
+    if recorded_ticks != ticks or digest != board_digest(state):
+        raise ValueError('replay ended on a different board than was recorded')
+
+    return state
+
+
+
+def play_inputs(state: Game.GameState, data: bytes, index: int, gems: [str], limit: int = None) -> (int, int):
+    '''
+    Runs recorded inputs from index until an end record, the end of data or limit clock ticks
+    Returns the index it stopped at and the number of ticks played
+    '''
+    ticks = 0
+
+    while index < len(data) and (limit is None or ticks < limit):
+        op = data[index] >> _op_shift
+        count = (data[index] & _count_mask) + 1
+
+        if op == _end_op and count - 1 == _end_input:
+            break
+
+        index += 1
+
+        if op == _clock_op:
+            if limit is not None and count > limit - ticks:
+                count = limit - ticks
+
+            for i in range(count):
+                state.clock()
+
+            ticks += count
+
+        elif op == _left_op:
+            for i in range(count):
+                state.move_side(Game.left)
+
+        elif op == _right_op:
+            for i in range(count):
+                state.move_side(Game.right)
+
+        elif op == _rotate_op:
+            for i in range(count):
+                state.rotate()
+
+        elif op == _drop_op:
+            state.hard_drop()
+
+        elif op == _faller_op:
+            column, index = _read_varint(data, index)
+            state.generate_faller(column, [gems[code] for code in data[index:index + 3]])
+            index += 3
+
+        elif op == _gem_op:
+            length, index = _read_varint(data, index)
+            gems.append(data[index:index + length].decode())
+            index += length
+
+        elif op == _end_op and count - 1 == _restore_input:
+            length, index = _read_varint(data, index)
+            state.restore(bytes(data[index:index + length]))
+            index += length
+
+        elif op == _end_op and count - 1 == _contents_input:
+            rows, index = _read_varint(data, index)
+            columns, index = _read_varint(data, index)
+            state.board_contents([[gems[code] for code in data[index + row * columns:index + (row + 1) * columns]]
+                                  for row in range(rows)])
+            index += rows * columns
+
+        elif op == _end_op and count - 1 == _settle_input:
+            state.settle()
+
+    return index, ticks
+
+
+
+def _main() -> None:
+    '''
+    Replays recordings from the command line and reports any that do not match
+    '''
+    parser = argparse.ArgumentParser(description='Checks Columns replays by running them headlessly')
+    parser.add_argument('paths', nargs='+')
+    arguments = parser.parse_args()
+
+    failed = 0
+    start = time.perf_counter()
+
+    for path in arguments.paths:
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        try:
+            replay(data)
+
+        except ValueError as error:
+            failed += 1
+            print('{}: {}'.format(path, error))
+
+    elapsed = time.perf_counter() - start
+
+    print('{} replays, {} failed in {:.2f}s'.format(len(arguments.paths), failed, elapsed))
+
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+
+
+class TranspositionTable:
+    '''
+    Bounded map from position hashes to search results
+
+    Entries are kept in least recently used order, so once the table is full
+    storing a new position evicts the one that has gone unused the longest.
+    '''
+    def __init__(self, capacity: int = 1 << 16):
+        if capacity < 1:
+            raise ValueError('transposition table capacity must be at least one')
+
+        self._capacity = capacity
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+
+
+    def capacity(self) -> int:
+        '''
+        Returns the most entries the table keeps
+        '''
+        return self._capacity
+
+
+
+    def get(self, key: int, default = None):
+        '''
+        Returns the value stored for a position hash, or default when not seen
+        '''
+        value = self._entries.get(key, self)
+
+        if value is self:
+            self.misses += 1
+
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+
+
+    def put(self, key: int, value) -> None:
+        '''
+        Stores the value for a position hash, evicting the oldest entry when full
+        '''
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+
+        if len(self._entries) > self._capacity:
+            self._entries.popitem(last=False)
+
+
+
+    def clear(self) -> None:
+        '''
+        Removes every entry and resets the counters
+        '''
+        self._entries.clear()
+
+        self.hits = 0
+        self.misses = 0
+
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._entries
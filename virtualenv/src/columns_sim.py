@@ -0,0 +1,233 @@
+import argparse
+import random
+import time
+
+import columns_game as Game
+import columns_replay as Replay
+
+
+left_action = 0
+right_action = 1
+rotate_action = 2
+clock_action = 3
+
+actions = [left_action, right_action, rotate_action, clock_action]
+
+
+faller_spawned = 'faller spawned'
+faller_landed = Game.faller_landed
+cells_matched = Game.cells_matched
+game_over = 'game over'
+
+
+topped_out = 'topped out'
+tick_limit = 'tick limit'
+
+
+class Simulation:
+    def __init__(self, seed: int = None, rows: int = 13, columns: int = 6, max_ticks: int = None, record: bool = False):
+        self._state = Game.GameState(rows, columns)
+
+        if record:
+            self._state = Replay.Recorder(self._state, seed or 0)
+
+        self._pieces = Game.PieceSource(columns, seed)
+        self._max_ticks = max_ticks
+
+        self._ticks = 0
+        self._cleared = 0
+        self._chain = 0
+        self._max_chain = 0
+        self._reason = None
+
+
+
+    def state(self) -> Game.GameState:
+        '''
+        Returns the game state being simulated
+        '''
+        return self._state
+
+
+
+    def pieces(self) -> Game.PieceSource:
+        '''
+        Returns the source of upcoming fallers
+        '''
+        return self._pieces
+
+
+
+    def over(self) -> bool:
+        '''
+        Determines if the game has ended
+        '''
+        return self._reason is not None
+
+
+
+    def step(self, action: int) -> [tuple]:
+        '''
+        Applies a move, rotation or clock tick and returns the resulting events
+        '''
+        if self.over():
+            return []
+
+        if action == left_action:
+            self._state.move_side(Game.left)
+
+        elif action == right_action:
+            self._state.move_side(Game.right)
+
+        elif action == rotate_action:
+            self._state.rotate()
+
+        elif action == clock_action:
+            return self._tick()
+
+        return []
+
+
+
+    def recording(self) -> bytes:
+        '''
+        Returns the replay of the game so far when it is being recorded
+        '''
+        return self._state.finish()
+
+
+
+    def result(self) -> dict:
+        '''
+        Returns the statistics of the game so far
+        '''
+        return {
+            'ticks': self._ticks,
+            'cleared': self._cleared,
+            'max_chain': self._max_chain,
+            'reason': self._reason
+        }
+
+
+
+    def _tick(self) -> [tuple]:
+        '''
+        Advances the game by one clock tick and generates a new faller when needed
+        '''
+        events = []
+
+        active = self._state.active_faller()
+        ended = self._state.clock()
+
+        self._ticks += 1
+
+        if active and not self._state.active_faller():
+            events.append((faller_landed,))
+
+        matched = self._state.matched_cells()
+
+        if matched:
+            self._cleared += len(matched)
+            self._chain += 1
+            self._max_chain = max(self._max_chain, self._chain)
+
+            events.append((cells_matched, matched))
+
+        else:
+            self._chain = 0
+
+        if ended:
+            self._reason = topped_out
+
+        elif self._max_ticks is not None and self._ticks >= self._max_ticks:
+            self._reason = tick_limit
+
+        if self._reason is not None:
+            events.append((game_over, self._reason))
+
+        elif not self._state.active_faller():
+            events.append(self._spawn())
+
+        return events
+
+
+
+    def _spawn(self) -> tuple:
+        '''
+        Generates the next faller from the piece source
+        '''
+        column, contents = self._pieces.next_piece()
+
+        self._state.generate_faller(column, contents)
+
+        return (faller_spawned, column, contents)
+
+
+
+def random_policy(seed: int = None):
+    '''
+    Returns a policy that picks uniformly random actions
+    '''
+    generator = random.Random(seed)
+
+    def policy(simulation: Simulation) -> int:
+        return generator.choice(actions)
+
+    return policy
+
+
+
+def play_game(seed: int, policy = None, rows: int = 13, columns: int = 6, max_ticks: int = 100000) -> dict:
+    '''
+    Plays one game to the end as fast as possible and returns its statistics
+    '''
+    simulation = Simulation(seed, rows, columns, max_ticks)
+
+    if policy is None:
+        policy = random_policy(seed)
+
+    while not simulation.over():
+        simulation.step(policy(simulation))
+
+    result = simulation.result()
+    result['seed'] = seed
+
+    return result
+
+
+
+def run_games(count: int, seed: int = None, rows: int = 13, columns: int = 6, max_ticks: int = 100000) -> [dict]:
+    '''
+    Plays the specified number of games with seeds drawn from one master seed
+    '''
+    generator = random.Random(seed)
+
+    return [play_game(generator.getrandbits(64), None, rows, columns, max_ticks) for i in range(count)]
+
+
+
+def _main() -> None:
+    '''
+    Runs headless games from the command line and reports the throughput
+    '''
+    parser = argparse.ArgumentParser(description='Runs headless Columns games')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rows', type=int, default=13)
+    parser.add_argument('--columns', type=int, default=6)
+    parser.add_argument('--max-ticks', type=int, default=100000)
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_games(arguments.games, arguments.seed, arguments.rows, arguments.columns, arguments.max_ticks)
+    elapsed = time.perf_counter() - start
+
+    ticks = sum(result['ticks'] for result in results)
+
+    print('{} games, {} ticks in {:.2f}s ({:.0f} games/s, {:.0f} ticks/s)'.format(
+        len(results), ticks, elapsed, len(results) / elapsed, ticks / elapsed))
+
+
+
+if __name__ == '__main__':
+    _main()